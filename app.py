@@ -1,14 +1,23 @@
-from flask import Flask, redirect, render_template, flash, session, request
+from flask import Flask, redirect, render_template, flash, session, request, g, send_file, abort
+from werkzeug.exceptions import NotFound
+from markupsafe import Markup
 import os
-import requests
-import json
-import statistics
+import time
+import threading
 import copy
+import hashlib
+from functools import wraps
 from flask_debugtoolbar import DebugToolbarExtension
-from models import db, connect_db, get_hashed_pwd, readable_time, readable_times, User, Game, Review, Question, Answer, Upvote
+from flask_migrate import Migrate
+import rawg
+import images
+from cache import TTLCache, SingleFlight
+from typeahead import game_index
+from models import db, connect_db, get_hashed_pwd, HashBusy, increment, reconcile_counts, add_upvote, remove_upvote, toggle_upvote, upvoted_ids, keyset_page, readable_time, User, Game, Review, Question, Answer, Upvote
 #from secrets import headers
 from forms import RegisterForm, LoginForm, UserEditForm, ReviewForm, QuestionForm, DeleteUserForm
-from sqlalchemy import func
+from sqlalchemy import func, event, inspect
+from sqlalchemy.orm import joinedload, load_only
 from sqlalchemy.exc import IntegrityError
 
 app = Flask(__name__)
@@ -17,37 +26,225 @@ app.config['SECRET_KEY'] = os.environ.get('SECRET_KEY', 'secsecsecretret')
 app.config['SQLALCHEMY_DATABASE_URI'] = os.environ.get('DATABASE_URL', 'postgresql:///gamey')
 #app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
 #app.config['SQLALCHEMY_ECHO'] = True
+app.config['GAME_SNAPSHOT_MAX_AGE'] = int(os.environ.get('GAME_SNAPSHOT_MAX_AGE', 7 * 24 * 60 * 60))
+app.config['RAWG_REQUEST_BUDGET'] = float(os.environ.get('RAWG_REQUEST_BUDGET', 4))
+app.config['LOCAL_SEARCH_MIN_RESULTS'] = int(os.environ.get('LOCAL_SEARCH_MIN_RESULTS', 5))
+app.config['PAGE_SIZE'] = int(os.environ.get('PAGE_SIZE', 20))
+app.config['FEED_CACHE_TTL'] = int(os.environ.get('FEED_CACHE_TTL', 60))
+app.config['PAGE_CACHE_ENTRIES'] = int(os.environ.get('PAGE_CACHE_ENTRIES', 1000))
+app.config['PAGE_CACHE_BYTES'] = int(os.environ.get('PAGE_CACHE_BYTES', 64 * 1024 * 1024))
 
 connect_db(app)
+migrate = Migrate(app, db)
 
-#BASE_URL = "https://rawg-video-games-database.p.rapidapi.com/games"
-BASE_URL = 'https://api.rawg.io/api/games'
-#head = os.environ.get('HEADERS')
-API_KEY = os.environ.get('API_KEY')
-# headers = json.loads(head)
+app.jinja_env.filters['proxied'] = images.proxied_url
+app.jinja_env.filters['readable_time'] = readable_time
 
 def login(user):
         """Add user to session"""
 
         session['username'] = user.username
+        g.current_user = user
 
 def logout():
         """Remove user from session"""
 
         session.pop('username')
+        g.current_user = None
+
+def get_current_user():
+    """The logged-in User, loaded at most once per request, or None
+
+    Only the username is loaded, which is all the ownership checks need;
+    other attributes load on first access.
+    """
+
+    if 'current_user' not in g:
+        g.current_user = None
+        if 'username' in session:
+            g.current_user = User.query.options(load_only('username')).get(session['username'])
+    return g.current_user
+
+@app.context_processor
+def inject_current_user():
+    """Make the logged-in user available to every template"""
+
+    return {'current_user': get_current_user()}
+
+# Newest template edit, so a deploy that changes markup changes every ETag
+templates_version = max(os.path.getmtime(os.path.join(root, name))
+                        for root, dirs, files in os.walk(os.path.join(app.root_path, app.template_folder))
+                        for name in files)
+
+def not_modified(*versions):
+    """Return a 304 if the client's copy of the page is current, else None
+
+    versions are what the page is built from: ids, counts and updated_at
+    stamps.  The viewer and templates are added, so only identical bytes
+    get a 304.  Only an ETag is sent: a Last-Modified date could not move
+    with counts, logins or deploys.  Pages with flashed messages waiting
+    are always rendered.
+    """
+
+    if '_flashes' in session:
+        return None
+    user = get_current_user()
+    key = repr((templates_version, user and user.username) + versions)
+    g.etag = hashlib.sha1(key.encode()).hexdigest()
+    if request.if_none_match.contains(g.etag):
+        return app.response_class(status=304)
+    return None
+
+@app.after_request
+def add_validators(response):
+    """Send the validators from not_modified, and have browsers revalidate"""
+
+    if 'etag' in g and response.status_code in (200, 304):
+        response.set_etag(g.etag)
+        must_revalidate(response)
+    return response
+
+def must_revalidate(response):
+    """Let browsers keep the page but check back before reusing it"""
+
+    response.cache_control.private = True
+    response.cache_control.no_cache = True
+    response.vary.add('Cookie')
+
+@app.before_request
+def start_rawg_budget():
+    """Give each request a fixed amount of time to spend waiting on RAWG"""
+
+    g.rawg_deadline = time.monotonic() + app.config['RAWG_REQUEST_BUDGET']
+
+def rawg_deadline():
+    """Deadline for RAWG calls made by the current request, if any"""
+
+    return g.get('rawg_deadline')
+
+@app.errorhandler(rawg.RawgUnavailable)
+def rawg_unavailable(e):
+    """Show a short notice instead of hanging or failing when RAWG is down"""
+
+    return render_template('unavailable.html'), 503
+
+@app.errorhandler(rawg.RawgNotFound)
+def rawg_not_found(e):
+    """A game RAWG doesn't know is a 404 here too"""
+
+    return NotFound()
+
+@app.errorhandler(HashBusy)
+def hash_busy(e):
+    """Ask the user to retry when password hashing is backed up"""
+
+    flash("Too many people are logging in right now.  Please try again.")
+    return redirect(request.path)
+
+# Rendered homepage feed, keyed by a version that every content change bumps
+feed_cache = TTLCache(ttl=app.config['FEED_CACHE_TTL'], max_entries=4)
+feed_version = 0
+feed_lock = threading.Lock()
+
+def bump_feed():
+    """Make the next homepage view re-render the feed"""
+
+    global feed_version
+    # Two threads adding 1 to the same old value would lose a bump
+    with feed_lock:
+        feed_version += 1
+    invalidate_pages('/')
+
+# Whole rendered pages for anonymous visitors, keyed by path and query string.
+# Each worker has its own copy, so invalidation only reaches the worker that
+# handled the write; the TTLs bound how stale the others can be.
+page_cache = TTLCache(ttl=60,
+                      max_entries=app.config['PAGE_CACHE_ENTRIES'],
+                      max_bytes=app.config['PAGE_CACHE_BYTES'],
+                      sizeof=lambda page: len(page[0]))
+
+def cache_page(ttl):
+    """Serve the view to anonymous GETs from page_cache for ttl seconds
+
+    Only 200 responses are stored, and not when the view sets
+    g.skip_page_cache.  Logged-in users and visitors with flashed
+    messages waiting always get a live page.
+    """
+
+    def decorator(view):
+        @wraps(view)
+        def cached_view(*args, **kwargs):
+            if 'username' in session or '_flashes' in session:
+                return view(*args, **kwargs)
+
+            key = request.full_path
+            page = page_cache.get(key)
+            if page is not None:
+                body, headers = page
+                response = app.response_class(body, headers=headers)
+                if not response.get_etag()[0]:
+                    response.add_etag()
+                must_revalidate(response)
+                return response.make_conditional(request)
+
+            # Store the validators from not_modified along with the page
+            response = add_validators(app.make_response(view(*args, **kwargs)))
+            if response.status_code == 200 and not g.get('skip_page_cache'):
+                headers = [(name, value) for name, value in response.headers if name != 'Set-Cookie']
+                page_cache.set(key, (response.get_data(), headers), ttl=ttl)
+            return response
+        return cached_view
+    return decorator
+
+def invalidate_pages(*paths):
+    """Drop cached pages at or below each path
+
+    '/games/3' drops the game's info, reviews and questions pages along
+    with every page of their query strings.
+    """
+
+    def affected(key):
+        path = key.partition('?')[0]
+        return any(path == p or path.startswith(p + '/') for p in paths)
+
+    page_cache.delete_where(affected)
+
+def invalidate_answered(question, username):
+    """Drop cached pages showing the question's answers or answer count
+
+    username is the author of the answer that was added or removed.
+    """
+
+    invalidate_pages(f'/questions/{question.id}', f'/games/{question.game_id}',
+                     f'/users/{question.username}', f'/users/{username}')
+
+def invalidate_upvoted(model, id):
+    """Drop cached pages showing the upvote count of a Review or Answer"""
+
+    if model is Review:
+        game_id = db.session.query(Review.game_id).filter_by(id=id).scalar()
+        invalidate_pages(f'/reviews/{id}', f'/games/{game_id}/reviews')
+    else:
+        question_id = db.session.query(Answer.question_id).filter_by(id=id).scalar()
+        invalidate_pages(f'/questions/{question_id}')
+
+def render_feed():
+    """Render the recent reviews and questions shown on the homepage"""
+
+    reviews = db.session.query(Review).options(joinedload(Review.game)).order_by(Review.id.desc()).limit(5)
+    reviews = list(reviews)
+    questions = db.session.query(Question).options(joinedload(Question.game)).order_by(Question.id.desc()).limit(5)
+    questions = list(questions)
+
+    return Markup(render_template('feed.html', reviews=reviews, questions=questions))
 
 @app.route('/')
+@cache_page(ttl=60)
 def show_homepage():
     """Show homepage"""
 
-    reviews = db.session.query(Review).order_by(Review.id.desc()).limit(5)
-    reviews = list(reviews)
-    reviews = readable_times(reviews)
-    questions = db.session.query(Question).order_by(Question.id.desc()).limit(5)
-    questions = list(questions)
-    questions = readable_times(questions)
-    
-    return render_template('home.html', reviews=reviews, questions=questions)
+    feed = feed_cache.fetch(feed_version, render_feed)
+    return render_template('home.html', feed=feed)
 
 
 ################## User Routes #######################
@@ -56,7 +253,7 @@ def show_homepage():
 def register_user():
     """Display registration form and submit new user registration"""
 
-    if 'username' in session:
+    if get_current_user():
         return redirect("/")
 
     form = RegisterForm()
@@ -84,7 +281,7 @@ def register_user():
 def login_user():
     """Display login form and validate login"""
 
-    if 'username' in session:
+    if get_current_user():
         return redirect("/")
 
     form = LoginForm()
@@ -94,6 +291,8 @@ def login_user():
                                  form.password.data)
 
         if user:
+            # Saves the password hash if authenticate upgraded its cost
+            db.session.commit()
             login(user)
             flash(f"Hello, {user.username}!")
             return redirect("/")
@@ -111,35 +310,43 @@ def logout_user():
     return redirect('/login')
 
 @app.route('/users/<username>')
+@cache_page(ttl=60)
 def show_user_profile(username):
     """Show individual user's profile details"""
 
     user = User.query.get_or_404(username)
-    user.reviews = readable_times(user.reviews)
-    user.reviews = sorted(user.reviews, reverse=True, key=lambda o: o.id)
-    user.questions = readable_times(user.questions)
-    user.questions = sorted(user.questions, reverse=True, key=lambda o: o.id)
-    ques = []
-    for answer in user.answers:
-        ques.append(answer.question)
-    ques = list(dict.fromkeys(ques))
-    ques = sorted(ques, reverse=True, key=lambda o: o.id)
-    return render_template('users/profile.html', user=user, ques=ques)
+    per_page = app.config['PAGE_SIZE']
+
+    reviews, next_reviews = keyset_page(
+                Review.query.filter_by(username=username).options(joinedload(Review.game)),
+                Review.id, request.args.get('reviews_before', type=int), per_page)
+    questions, next_questions = keyset_page(
+                Question.query.filter_by(username=username).options(joinedload(Question.game)),
+                Question.id, request.args.get('questions_before', type=int), per_page)
+    answered = db.session.query(Answer.question_id).filter_by(username=username)
+    ques, next_ques = keyset_page(
+                Question.query.filter(Question.id.in_(answered)).options(joinedload(Question.game)),
+                Question.id, request.args.get('answered_before', type=int), per_page)
+    return render_template('users/profile.html', user=user, reviews=reviews, questions=questions, ques=ques,
+                next_reviews=next_reviews, next_questions=next_questions, next_ques=next_ques)
 
 @app.route('/users/<username>/edit', methods=["GET", "POST"])
 def edit_user(username):
     """Render form to edit user and handle form submission"""
 
-    u = User.query.get_or_404(username)
-    if ('username' not in session) or (session['username'] != u.username):
+    current_user = get_current_user()
+    if not current_user or current_user.username != username:
         flash("Access unauthorized")
         return redirect("/")
+    u = User.query.populate_existing().get_or_404(username)
 
     form = UserEditForm(obj=u)
 
     if form.validate_on_submit():
+        # A new password is hashed below anyway, so skip upgrading the old one
         user = User.authenticate(u.username,
-                                 form.password.data)
+                                 form.password.data,
+                                 rehash=not form.new_password.data)
 
         if user:
             if form.email.data:
@@ -153,6 +360,7 @@ def edit_user(username):
                 user.password = hashed_pwd
 
             db.session.commit()
+            invalidate_pages(f'/users/{user.username}')
             return redirect(f'/users/{user.username}')
         else:
             flash('Username and password do not match')
@@ -164,8 +372,8 @@ def edit_user(username):
 def delete_user(username):
     """Delete current user"""
 
-    user = User.query.get_or_404(username)
-    if ('username' not in session) or (session['username'] != user.username):
+    user = get_current_user()
+    if not user or user.username != username:
         flash("Access unauthorized")
         return redirect("/")
 
@@ -173,12 +381,16 @@ def delete_user(username):
 
     if form.validate_on_submit():
         user = User.authenticate(user.username,
-                                 form.password.data)
+                                 form.password.data,
+                                 rehash=False)
 
         logout()
 
         db.session.delete(user)
         db.session.commit()
+        bump_feed()
+        # Their posts now show as by a deleted user on every page
+        page_cache.clear()
 
         flash('Game Over')
 
@@ -189,105 +401,250 @@ def delete_user(username):
 
 ################# Game Routes #####################
 
+refreshing_games = set()
+refreshing_lock = threading.Lock()
+creating_games = SingleFlight()
+
+def get_or_create_game(game_id, snapshot=False):
+    """Return the Game row for game_id, creating it from RAWG on first visit
+
+    With snapshot=True the RAWG snapshot is also filled in if it is
+    missing, and snapshots older than GAME_SNAPSHOT_MAX_AGE are served as
+    they are and refreshed by a background thread.
+    """
+
+    game = Game.query.filter_by(id=game_id).first()
+
+    if game is None or (snapshot and game.fetched_at is None):
+        # Concurrent first visits wait for one insert, then reload the row
+        try:
+            creating_games.do(str(game_id), lambda: store_game_snapshot(game_id),
+                              timeout=rawg.remaining(rawg_deadline()))
+        except TimeoutError as e:
+            raise rawg.RawgUnavailable(str(e)) from e
+        game = Game.query.populate_existing().filter_by(id=game_id).first()
+    elif snapshot and game.is_stale(app.config['GAME_SNAPSHOT_MAX_AGE']):
+        with refreshing_lock:
+            if game.id in refreshing_games:
+                return game
+            refreshing_games.add(game.id)
+        threading.Thread(target=refresh_game_snapshot, args=(game.id,), daemon=True).start()
+
+    return game
+
+def store_game_snapshot(game_id):
+    """Insert or update a game's row from RAWG and commit it"""
+
+    game_api_data = rawg.get_game(game_id, deadline=rawg_deadline())
+    game = Game.query.filter_by(id=game_id).first()
+    if game is None:
+        game = Game.add_game_to_db(
+                    id=game_id,
+                    name=game_api_data.name,
+                    background_image=game_api_data.background_image)
+    game.update_snapshot(game_api_data)
+    try:
+        db.session.commit()
+    except IntegrityError:
+        # Another process inserted the same game first
+        db.session.rollback()
+
+def refresh_game_snapshot(game_id):
+    """Reload a game's snapshot from RAWG outside of the request"""
+
+    try:
+        with app.app_context():
+            game = Game.query.get(game_id)
+            game.update_snapshot(rawg.get_game(game_id))
+            db.session.commit()
+        invalidate_pages(f'/games/{game_id}')
+    except rawg.RawgError:
+        pass
+    finally:
+        with refreshing_lock:
+            refreshing_games.discard(game_id)
+
+@app.cli.command('refresh-games')
+def refresh_games_command():
+    """Refresh every game snapshot older than GAME_SNAPSHOT_MAX_AGE"""
+
+    for game in Game.query.all():
+        if game.is_stale(app.config['GAME_SNAPSHOT_MAX_AGE']):
+            try:
+                game.update_snapshot(rawg.get_game(game.id))
+                db.session.commit()
+            except rawg.RawgError:
+                db.session.rollback()
+
+@app.cli.command('reconcile-counts')
+def reconcile_counts_command():
+    """Recompute upvote and answer counters from the underlying rows"""
+
+    reconcile_counts()
+    db.session.commit()
+
+@app.route('/rawg/status')
+def show_rawg_status():
+    """Return RAWG quota usage and cache counters"""
+
+    return rawg.stats()
+
+@app.route('/images/<variant>')
+def proxy_image(variant):
+    """Serve a resized, disk-cached copy of a RAWG image"""
+
+    src = request.args.get('src', '')
+    if variant not in images.VARIANTS or not images.is_proxyable(src):
+        abort(404)
+
+    try:
+        path, key = images.get_image(src, variant)
+    except images.ImageError:
+        return redirect(src)
+
+    resp = send_file(path,
+                     mimetype=images.mimetype(src, variant),
+                     add_etags=False,
+                     cache_timeout=365 * 24 * 60 * 60)
+    resp.set_etag(key)
+    resp.cache_control.public = True
+    return resp.make_conditional(request)
+
 @app.route('/games/search')
+@cache_page(ttl=120)
 def search_games():
     """Search game title and display list of possible matches"""
 
     game = request.args['game']
-    #resp = requests.get(f'{BASE_URL}?search={game}', headers=headers)
-    resp = requests.get(f'{BASE_URL}?key={API_KEY}&search={game}')
-    resp = json.loads(resp.text)
-    games = resp["results"]
-    return render_template('games/results.html', games=games)
+    local = request.args.get('source') != 'rawg'
+
+    # Blank or punctuation-only searches match nothing, locally or on RAWG
+    if not rawg.normalize_query(game):
+        return render_template('games/results.html', games=[], query=game, local=False)
+
+    # Answer from games we already know when there are enough fresh matches
+    games = Game.search(game) if local else []
+    fresh = [match for match in games if not match.is_stale(app.config['GAME_SNAPSHOT_MAX_AGE'])]
+    if local and len(fresh) >= app.config['LOCAL_SEARCH_MIN_RESULTS']:
+        return render_template('games/results.html', games=games, query=game, local=True)
+
+    try:
+        games = rawg.search_games(game, deadline=rawg_deadline())
+    except rawg.RawgError:
+        if not games:
+            raise
+        return render_template('games/results.html', games=games, query=game, local=True)
+
+    return render_template('games/results.html', games=games, query=game, local=False)
+
+@app.route('/games/typeahead')
+def game_typeahead():
+    """Return names of known games matching the start of the search text"""
+
+    game_index.ensure_loaded(lambda: db.session.query(Game.id, Game.name).all())
+    games = game_index.search(request.args.get('q', ''))
+    return {'games': [{'id': id, 'name': name} for id, name in games]}
+
+@event.listens_for(Game, 'after_insert')
+@event.listens_for(Game, 'after_update')
+def queue_indexed_game(mapper, connection, game):
+    """Note new or renamed games for the typeahead index once committed"""
+
+    if inspect(game).attrs.name.history.has_changes():
+        inspect(game).session.info.setdefault('indexed_games', {})[game.id] = game.name
+
+@event.listens_for(db.session, 'after_commit')
+def index_committed_games(session):
+    """Apply the games noted by queue_indexed_game to the typeahead index"""
+
+    games = session.info.pop('indexed_games', {})
+    if game_index.loaded:
+        for id, name in games.items():
+            game_index.add(id, name)
+
+@event.listens_for(db.session, 'after_rollback')
+def discard_indexed_games(session):
+    """Forget games whose rows were rolled back"""
+
+    session.info.pop('indexed_games', None)
 
 @app.route('/games/<game_id>')
+@cache_page(ttl=300)
 def show_game_info(game_id):
     """Show information about a specific game"""
 
-    game = Game.query.filter_by(id=game_id).first()
-    
-    #resp = requests.get(f'{BASE_URL}/{game_id}', headers=headers)
-    resp = requests.get(f'{BASE_URL}/{game_id}?key={API_KEY}')
-    game_api_data = json.loads(resp.text)
+    try:
+        game = get_or_create_game(game_id, snapshot=True)
+    except rawg.RawgError:
+        # Fall back to the name and image we already have
+        db.session.rollback()
+        game = Game.query.filter_by(id=game_id).first()
+        if game is None:
+            raise
+        g.skip_page_cache = True
 
-    if game:
-        return render_template('games/info.html', game=game, game_api_data=game_api_data)
+    cached = not_modified(game.id, game.updated_at)
+    if cached:
+        return cached
 
-    new_game = Game.add_game_to_db(
-                    id=game_id, 
-                    name=game_api_data['name'], 
-                    background_image=game_api_data['background_image'])
-
-    db.session.commit()
-    return render_template('games/info.html', game=new_game, game_api_data=game_api_data)
+    return render_template('games/info.html', game=game)
 
 @app.route('/games/<game_id>/screenshots')
+@cache_page(ttl=300)
 def show_screenshots(game_id):
     """Show all screenshots for a game"""
 
-    game = Game.query.filter_by(id=game_id).first()
-    #resp = requests.get(f'{BASE_URL}/{game_id}/screenshots', headers=headers)
-    resp = requests.get(f'{BASE_URL}/{game_id}/screenshots?key={API_KEY}')
-    screenshots = json.loads(resp.text)
-    screenshots = screenshots['results']
-
-    if game:
-        return render_template('games/screenshots.html', game=game, screenshots=screenshots)
-
-    #resp = requests.get(f'{BASE_URL}/{game_id}', headers=headers)
-    resp = requests.get(f'{BASE_URL}/{game_id}?key={API_KEY}')
-    game_api_data = json.loads(resp.text)
-    new_game = Game.add_game_to_db(
-                    id=game_id, 
-                    name=game_api_data['name'], 
-                    background_image=game_api_data['background_image'])
+    calls = {'screenshots': lambda deadline: rawg.get_screenshots(game_id, deadline=deadline)}
+    if Game.query.filter_by(id=game_id).first() is None:
+        # Cold game: fetch its details alongside the screenshots
+        calls['game'] = lambda deadline: rawg.get_game(game_id, deadline=deadline)
+    results = rawg.fetch_all(calls, deadline=rawg_deadline())
 
-    db.session.commit()
-    return render_template('games/screenshots.html', game=new_game, screenshots=screenshots)
+    if isinstance(results.get('game'), rawg.RawgError):
+        raise results['game']
+    game = get_or_create_game(game_id)
+    screenshots = results['screenshots']
+
+    if isinstance(screenshots, rawg.RawgError):
+        g.skip_page_cache = True
+        return render_template('games/screenshots.html', game=game, screenshots=[], degraded=True)
+
+    return render_template('games/screenshots.html', game=game, screenshots=screenshots)
 
 
 ####################### Review Routes ###########################
 
 @app.route('/games/<game_id>/reviews')
+@cache_page(ttl=60)
 def show_game_reviews(game_id):
     """Show list of reviews for a specific game"""
 
-    game = Game.query.filter_by(id=game_id).first()
-    reviews = game.reviews
-    reviews = readable_times(reviews)
-    reviews = sorted(reviews, reverse=True, key=lambda o: o.id)
-    ratings = []
-    for review in game.reviews:
-        ratings.append(review.rating)
-    if ratings:
-        average = round(statistics.mean(ratings), 2)
-    else:
+    game = get_or_create_game(game_id)
+    count, updated_at = (db.session.query(func.count(Review.id), func.max(Review.updated_at))
+                                   .filter(Review.game_id == game.id).one())
+    cached = not_modified(game.id, game.updated_at, count, updated_at)
+    if cached:
+        return cached
+
+    reviews, next_cursor = keyset_page(Review.query.filter_by(game_id=game.id), Review.id,
+                                       request.args.get('before', type=int), app.config['PAGE_SIZE'])
+    average = game.average_rating
+    if average is None:
         average = "No ratings yet"
 
-    if game:
-        return render_template('games/reviews.html', game=game, average=average, reviews=reviews)
-
-    #resp = requests.get(f'{BASE_URL}/{game_id}', headers=headers)
-    resp = requests.get(f'{BASE_URL}/{game_id}?key={API_KEY}')
-    game_api_data = json.loads(resp.text)
-    new_game = Game.add_game_to_db(
-                    id=game_id, 
-                    name=game_api_data['name'], 
-                    background_image=game_api_data['background_image'])
-
-    db.session.commit()
-    return render_template('games/reviews.html', game=new_game, average=average, reviews=reviews)
+    return render_template('games/reviews.html', game=game, average=average, reviews=reviews,
+                next_cursor=next_cursor)
 
 @app.route('/games/<game_id>/review', methods=['GET', 'POST'])
 def add_review(game_id):
     """Add a review for the selected game"""
 
-    if 'username' not in session:
+    user = get_current_user()
+    if not user:
         flash("You must be logged in to write a review")
         return redirect(f"/games/{game_id}/reviews")
 
     game = Game.query.filter_by(id=game_id).first()
-    user = User.query.get_or_404(session['username'])
     form = ReviewForm()
 
     if form.validate_on_submit():
@@ -298,7 +655,11 @@ def add_review(game_id):
                         username=user.username)
         
         db.session.add(review)
+        increment(Game.rating_count, game_id)
+        increment(Game.rating_sum, game_id, review.rating)
         db.session.commit()
+        bump_feed()
+        invalidate_pages(f'/games/{game_id}', f'/users/{user.username}')
 
         flash(f'Thanks for reviewing {game.name}')
         return redirect(f'/games/{game_id}/reviews')
@@ -306,16 +667,19 @@ def add_review(game_id):
     return render_template('/games/add_review.html', form=form, game=game, user=user)
 
 @app.route('/reviews/<review_id>')
+@cache_page(ttl=60)
 def show_review(review_id):
     """Show the selected review"""
 
-    review = Review.query.get_or_404(review_id)
-    review = readable_time(review)
-    upvotes = []
-    for upvote in review.upvotes:
-        upvotes.append(upvote.username)
+    review = Review.query.options(joinedload(Review.game)).get_or_404(review_id)
+    cached = not_modified(review.id, review.updated_at, review.game.updated_at)
+    if cached:
+        return cached
 
-    return render_template('games/review.html', review=review, game=review.game, upvotes=upvotes)
+    user = get_current_user()
+    upvoted = bool(user and upvoted_ids(Upvote.review_id, [review.id], user.username))
+
+    return render_template('games/review.html', review=review, game=review.game, upvoted=upvoted)
 
 @app.route('/reviews/<review_id>/edit', methods=["GET", "POST"])
 def edit_review(review_id):
@@ -323,7 +687,8 @@ def edit_review(review_id):
 
     review = Review.query.get_or_404(review_id)
 
-    if ('username' not in session) or (session['username'] != review.username):
+    current_user = get_current_user()
+    if not current_user or current_user.username != review.username:
         flash("Only a review's author can edit a review")
         return redirect(f"/")
 
@@ -333,11 +698,14 @@ def edit_review(review_id):
         if form.title.data:
             review.title = form.title.data
         if form.rating.data:
+            increment(Game.rating_sum, review.game_id, form.rating.data - review.rating)
             review.rating = form.rating.data
         if form.text.data:
             review.text = form.text.data
 
         db.session.commit()
+        bump_feed()
+        invalidate_pages(f'/reviews/{review.id}', f'/games/{review.game_id}', f'/users/{review.username}')
         return redirect(f'/reviews/{review.id}')
 
     return render_template('games/edit_review.html', form=form, review=review, game=review.game)
@@ -349,12 +717,17 @@ def delete_review(review_id):
     review = Review.query.get_or_404(review_id)
     game_id = copy.deepcopy(review.game_id)
 
-    if ('username' not in session) or (session['username'] != review.username):
+    current_user = get_current_user()
+    if not current_user or current_user.username != review.username:
         flash("You can only delete your own review")
         return redirect('/')
 
+    increment(Game.rating_count, game_id, -1)
+    increment(Game.rating_sum, game_id, -review.rating)
     db.session.delete(review)
     db.session.commit()
+    bump_feed()
+    invalidate_pages(f'/reviews/{review_id}', f'/games/{game_id}', f'/users/{current_user.username}')
 
     resp = {'game_id': game_id}
     return resp
@@ -363,38 +736,33 @@ def delete_review(review_id):
 ##################### Question Routes ##########################
 
 @app.route('/games/<game_id>/questions')
+@cache_page(ttl=60)
 def show_game_questions(game_id):
     """Show list of questions for a specific game"""
 
-    game = Game.query.filter_by(id=game_id).first()
-    questions = game.questions
-    questions = readable_times(questions)
-    questions = sorted(questions, reverse=True, key=lambda o: o.id)
+    game = get_or_create_game(game_id)
+    count, updated_at = (db.session.query(func.count(Question.id), func.max(Question.updated_at))
+                                   .filter(Question.game_id == game.id).one())
+    cached = not_modified(game.id, game.updated_at, count, updated_at)
+    if cached:
+        return cached
 
-    if game:
-        return render_template('games/questions.html', game=game, questions=questions)
+    questions, next_cursor = keyset_page(Question.query.filter_by(game_id=game.id), Question.id,
+                                         request.args.get('before', type=int), app.config['PAGE_SIZE'])
 
-    #resp = requests.get(f'{BASE_URL}/{game_id}', headers=headers)
-    resp = requests.get(f'{BASE_URL}/{game_id}?key={API_KEY}')
-    game_api_data = json.loads(resp.text)
-    new_game = Game.add_game_to_db(
-                    id=game_id, 
-                    name=game_api_data['name'], 
-                    background_image=game_api_data['background_image'])
-
-    db.session.commit()
-    return render_template('games/questions.html', game=new_game, questions=questions)
+    return render_template('games/questions.html', game=game, questions=questions,
+                next_cursor=next_cursor)
 
 @app.route('/games/<game_id>/question', methods=['GET', 'POST'])
 def add_question(game_id):
     """Add a question for the selected game"""
 
-    if 'username' not in session:
+    user = get_current_user()
+    if not user:
         flash("You must be logged in to ask a question")
         return redirect(f"/games/{game_id}/questions")
 
     game = Game.query.filter_by(id=game_id).first()
-    user = User.query.get_or_404(session['username'])
     form = QuestionForm()
 
     if form.validate_on_submit():
@@ -405,6 +773,8 @@ def add_question(game_id):
         
         db.session.add(question)
         db.session.commit()
+        bump_feed()
+        invalidate_pages(f'/games/{game_id}', f'/users/{user.username}')
 
         flash('Thanks for your question.  Hopefully it will soon be answered.')
         return redirect(f'/games/{game_id}/questions')
@@ -412,21 +782,20 @@ def add_question(game_id):
     return render_template('/games/add_question.html', form=form, game=game, user=user)
 
 @app.route('/questions/<question_id>')
+@cache_page(ttl=60)
 def show_question(question_id):
     """Show the selected question"""
 
-    question = Question.query.get_or_404(question_id)
-    question = readable_time(question)
-    answers = question.answers
-    answers = readable_times(answers)
-    answers = sorted(answers, key=lambda o: o.id)
-    upvotes = []
-    if 'username' in session:
-        username = session['username']
-        user = User.query.get_or_404(username)
-        for upvote in user.upvotes:
-            if upvote.answer_id:
-                upvotes.append(upvote.answer_id)
+    question = Question.query.options(joinedload(Question.game)).get_or_404(question_id)
+    count, updated_at = (db.session.query(func.count(Answer.id), func.max(Answer.updated_at))
+                                   .filter(Answer.question_id == question.id).one())
+    cached = not_modified(question.id, question.updated_at, question.game.updated_at, count, updated_at)
+    if cached:
+        return cached
+
+    answers = Answer.query.filter_by(question_id=question.id).order_by(Answer.id).all()
+    user = get_current_user()
+    upvotes = upvoted_ids(Upvote.answer_id, [answer.id for answer in answers], user.username) if user else set()
     return render_template('games/question.html', 
                 question=question, game=question.game, upvotes=upvotes, answers=answers)
 
@@ -436,7 +805,8 @@ def edit_question(question_id):
 
     question = Question.query.get_or_404(question_id)
 
-    if ('username' not in session) or (session['username'] != question.username):
+    current_user = get_current_user()
+    if not current_user or current_user.username != question.username:
         flash("Only a question's author can edit a question")
         return redirect(f"/")
 
@@ -449,6 +819,8 @@ def edit_question(question_id):
             question.text = form.text.data
 
         db.session.commit()
+        bump_feed()
+        invalidate_pages(f'/questions/{question.id}', f'/games/{question.game_id}', f'/users/{question.username}')
         return redirect(f'/questions/{question.id}')
 
     return render_template('games/edit_question.html', form=form, question=question, game=question.game)
@@ -460,12 +832,15 @@ def delete_question(question_id):
     question = Question.query.get_or_404(question_id)
     game_id = copy.deepcopy(question.game_id)
 
-    if ('username' not in session) or (session['username'] != question.username):
+    current_user = get_current_user()
+    if not current_user or current_user.username != question.username:
         flash("You can only delete your own question")
         return redirect('/')
 
     db.session.delete(question)
     db.session.commit()
+    bump_feed()
+    invalidate_pages(f'/questions/{question_id}', f'/games/{game_id}', f'/users/{current_user.username}')
 
     resp = {'game_id': game_id}
     return resp
@@ -477,17 +852,20 @@ def delete_question(question_id):
 def post_answer(question_id):
     """Post answer to database and return answer text"""
 
-    if 'username' not in session:
+    user = get_current_user()
+    if not user:
         flash("You must be logged in to answer a question")
         return redirect(f"/")
 
     text = request.json['text']
-    username = session['username']
+    username = user.username
     question_id = question_id
     answer = Answer(text=text, username=username, question_id=question_id)
 
     db.session.add(answer)
+    increment(Question.answer_count, question_id)
     db.session.commit()
+    invalidate_answered(answer.question, username)
 
     resp = {'answer_id': answer.id, 'text': answer.text, 'username': answer.username, 'timestamp': answer.timestamp}
 
@@ -499,13 +877,15 @@ def edit_answer(answer_id):
 
     answer = Answer.query.get_or_404(answer_id)
 
-    if ('username' not in session) or (session['username'] != answer.username):
+    current_user = get_current_user()
+    if not current_user or current_user.username != answer.username:
         flash("You can only edit your own answer", "danger")
         return redirect("/")
 
     answer.text = request.json['text']
 
     db.session.commit()
+    invalidate_pages(f'/questions/{answer.question_id}')
 
     resp = {'text': answer.text}
     return resp
@@ -516,12 +896,16 @@ def delete_answer(answer_id):
 
     answer = Answer.query.get_or_404(answer_id)
 
-    if ('username' not in session) or (session['username'] != answer.username):
+    current_user = get_current_user()
+    if not current_user or current_user.username != answer.username:
         flash("You can only delete your own answer")
         return redirect('/')
 
+    question, username = answer.question, answer.username
+    increment(Question.answer_count, answer.question_id, -1)
     db.session.delete(answer)
     db.session.commit()
+    invalidate_answered(question, username)
 
     resp = {'delete': 'success'}
     return resp
@@ -529,86 +913,122 @@ def delete_answer(answer_id):
 
 ################### Upvote Routes ############################
 
-@app.route('/reviews/<review_id>/upvote', methods=["POST"])
+@app.route('/reviews/<int:review_id>/upvote', methods=["POST"])
 def like_review(review_id):
     """Post upvote on review to database"""
 
-    if 'username' not in session:
+    user = get_current_user()
+    if not user:
         flash("You must be logged in to like a review")
         return redirect(f"/")
 
-    review = Review.query.get_or_404(review_id)
-
-    if session['username'] == review.user.username:
+    username = user.username
+    added, count = add_upvote(Review, review_id, username)
+    if count is None:
+        abort(404)
+    if not added and db.session.query(Review.username).filter_by(id=review_id).scalar() == username:
         flash("It is important to like yourself, but you can't like your own review")
         return redirect(f"/")
-
-    username = session['username']
-    upvote = Upvote(username=username, review_id=review_id)
-
-    db.session.add(upvote)
     db.session.commit()
+    if added:
+        invalidate_upvoted(Review, review_id)
 
-    resp = {'review': upvote.review_id, 'username': upvote.username}
+    resp = {'review': review_id, 'username': username}
     return resp
 
-@app.route('/reviews/<review_id>/remove_upvote', methods=["DELETE"])
+@app.route('/reviews/<int:review_id>/remove_upvote', methods=["DELETE"])
 def unlike_review(review_id):
     """Remove upvote on review from database"""
 
-    if 'username' not in session:
+    user = get_current_user()
+    if not user:
         flash("You must be logged in to remove a like")
         return redirect(f"/")
 
-    review = Review.query.get_or_404(review_id)
-    username = session['username']
+    removed, count = remove_upvote(Review, review_id, user.username)
+    if count is None:
+        abort(404)
+    db.session.commit()
+    if removed:
+        invalidate_upvoted(Review, review_id)
 
-    for upvote in review.upvotes:
-        if upvote.username == username:
-            db.session.delete(upvote)
-            db.session.commit()
-    
-    resp = {'review': review.id}
+    resp = {'review': review_id}
     return resp
 
-@app.route('/answers/<answer_id>/upvote', methods=["POST"])
+@app.route('/reviews/<int:review_id>/toggle_upvote', methods=["POST"])
+def toggle_review_upvote(review_id):
+    """Upvote the review, or take the upvote back if already given"""
+
+    user = get_current_user()
+    if not user:
+        flash("You must be logged in to like a review")
+        return redirect(f"/")
+
+    upvoted, count = toggle_upvote(Review, review_id, user.username)
+    if count is None:
+        abort(404)
+    db.session.commit()
+    invalidate_upvoted(Review, review_id)
+
+    resp = {'review': review_id, 'upvoted': upvoted, 'upvotes': count}
+    return resp
+
+@app.route('/answers/<int:answer_id>/upvote', methods=["POST"])
 def like_answer(answer_id):
     """Post upvote on answer to database"""
 
-    if 'username' not in session:
+    user = get_current_user()
+    if not user:
         flash("You must be logged in to like an answer")
         return redirect(f"/")
 
-    answer = Answer.query.get_or_404(answer_id)
-
-    if session['username'] == answer.user.username:
+    username = user.username
+    added, count = add_upvote(Answer, answer_id, username)
+    if count is None:
+        abort(404)
+    if not added and db.session.query(Answer.username).filter_by(id=answer_id).scalar() == username:
         flash("It is important to like yourself, but you can't like your own answer")
         return redirect(f"/")
-
-    username = session['username']
-    upvote = Upvote(username=username, answer_id=answer_id)
-
-    db.session.add(upvote)
     db.session.commit()
+    if added:
+        invalidate_upvoted(Answer, answer_id)
 
-    resp = {'answer': upvote.answer_id, 'username': upvote.username}
+    resp = {'answer': answer_id, 'username': username}
     return resp
 
-@app.route('/answers/<answer_id>/remove_upvote', methods=["DELETE"])
+@app.route('/answers/<int:answer_id>/remove_upvote', methods=["DELETE"])
 def unlike_answer(answer_id):
     """Remove upvote on answer from database"""
 
-    if 'username' not in session:
+    user = get_current_user()
+    if not user:
         flash("You must be logged in to remove a like", "danger")
         return redirect(f"/")
 
-    answer = Answer.query.get_or_404(answer_id)
-    username = session['username']
+    removed, count = remove_upvote(Answer, answer_id, user.username)
+    if count is None:
+        abort(404)
+    db.session.commit()
+    if removed:
+        invalidate_upvoted(Answer, answer_id)
 
-    for upvote in answer.upvotes:
-        if upvote.username == username:
-            db.session.delete(upvote)
-            db.session.commit()
-    
-    resp = {'answer': answer.id}
+    resp = {'answer': answer_id}
+    return resp
+
+@app.route('/answers/<int:answer_id>/toggle_upvote', methods=["POST"])
+def toggle_answer_upvote(answer_id):
+    """Upvote the answer, or take the upvote back if already given"""
+
+    user = get_current_user()
+    if not user:
+        flash("You must be logged in to like an answer")
+        return redirect(f"/")
+
+    upvoted, count = toggle_upvote(Answer, answer_id, user.username)
+    if count is None:
+        abort(404)
+    db.session.commit()
+    invalidate_upvoted(Answer, answer_id)
+
+    resp = {'answer': answer_id, 'upvoted': upvoted, 'upvotes': count}
     return resp
\ No newline at end of file
@@ -0,0 +1,47 @@
+"""Logins per second at each bcrypt cost
+
+    python bench_bcrypt.py [--costs 10-14] [--logins 50]
+
+Each cost hashes one password and then verifies it --logins times through
+the same bounded pool the app uses, so the figure is what one worker
+process can sustain with BCRYPT_WORKERS threads.  Pick the highest cost
+that still covers peak logins with room to spare.
+"""
+
+import argparse
+import time
+from flask_bcrypt import Bcrypt
+from models import hash_pool, BCRYPT_WORKERS, BCRYPT_LOG_ROUNDS
+
+bcrypt = Bcrypt()
+
+
+def cost_range(text):
+    low, _, high = text.partition('-')
+    return range(int(low), int(high or low) + 1)
+
+def bench(cost, logins):
+    """Return (seconds per hash, logins per second) at cost"""
+
+    start = time.perf_counter()
+    hashed = bcrypt.generate_password_hash('correct horse battery staple', cost)
+    hash_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    futures = [hash_pool.submit(bcrypt.check_password_hash, hashed, 'correct horse battery staple')
+               for i in range(logins)]
+    assert all(f.result() for f in futures)
+    return hash_time, logins / (time.perf_counter() - start)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--costs', type=cost_range, default=cost_range('10-14'))
+    parser.add_argument('--logins', type=int, default=50)
+    args = parser.parse_args()
+
+    print(f'{BCRYPT_WORKERS} workers, configured cost {BCRYPT_LOG_ROUNDS}')
+    print('cost  ms/hash  logins/s')
+    for cost in args.costs:
+        hash_time, rate = bench(cost, args.logins)
+        print(f'{cost:4}  {hash_time * 1000:7.1f}  {rate:8.1f}')
@@ -0,0 +1,205 @@
+import threading
+import time
+from collections import OrderedDict
+
+
+class TTLCache:
+    """Thread-safe in-process cache with TTL expiry and LRU eviction
+
+    Entries expire `ttl` seconds after they are stored, or after the ttl
+    given to `set` for that entry.  An expired entry is still served for
+    another `stale_ttl` seconds by `fetch` while a single background
+    refresh replaces it (stale-while-revalidate).  The cache holds at most
+    `max_entries` entries and, when `sizeof` is given, at most `max_bytes`
+    worth of values.  Expired entries are kept until evicted so `fetch`
+    can fall back to them when loading fails.
+    """
+
+    def __init__(self, ttl, max_entries=1000, max_bytes=None, sizeof=None, stale_ttl=0):
+        self.ttl = ttl
+        self.stale_ttl = stale_ttl
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.sizeof = sizeof
+        self.nbytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.stale_hits = 0
+        self._entries = OrderedDict()
+        self._refreshing = set()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def _lookup(self, key, allow_stale=False):
+        """Return (value, is_fresh) for key, or None; caller holds the lock"""
+
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        value, stored, size, ttl = entry
+        age = time.monotonic() - stored
+        if age > ttl + self.stale_ttl or (age > ttl and not allow_stale):
+            return None
+        self._entries.move_to_end(key)
+        return value, age <= ttl
+
+    def _remove(self, key):
+        value, stored, size, ttl = self._entries.pop(key)
+        self.nbytes -= size
+
+    def get(self, key, allow_stale=False):
+        """Return the cached value for key, or None"""
+
+        with self._lock:
+            found = self._lookup(key, allow_stale)
+            if found is None:
+                self.misses += 1
+                return None
+            if found[1]:
+                self.hits += 1
+            else:
+                self.stale_hits += 1
+            return found[0]
+
+    def set(self, key, value, ttl=None):
+        """Store value under key, evicting least recently used entries"""
+
+        size = self.sizeof(value) if self.sizeof else 0
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+            self._entries[key] = (value, time.monotonic(), size, self.ttl if ttl is None else ttl)
+            self.nbytes += size
+            while self._entries and (len(self._entries) > self.max_entries or
+                    (self.max_bytes is not None and self.nbytes > self.max_bytes)):
+                self._remove(next(iter(self._entries)))
+
+    def delete(self, key):
+        """Drop key from the cache if present"""
+
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+
+    def delete_where(self, predicate):
+        """Drop every key for which predicate(key) is true"""
+
+        with self._lock:
+            for key in [key for key in self._entries if predicate(key)]:
+                self._remove(key)
+
+    def clear(self):
+        """Drop every entry"""
+
+        with self._lock:
+            self._entries.clear()
+            self.nbytes = 0
+
+    def fetch(self, key, loader, refresh=None, fallback=()):
+        """Return the cached value for key, calling loader() on a miss
+
+        A stale entry is returned immediately and refreshed by one
+        background thread calling refresh(), which defaults to loader.
+        If loader() raises one of the `fallback` exception types, any
+        expired value still held for key is returned instead.
+        """
+
+        with self._lock:
+            found = self._lookup(key, allow_stale=True)
+            if found is not None:
+                value, fresh = found
+                if fresh:
+                    self.hits += 1
+                    return value
+                self.stale_hits += 1
+                if key not in self._refreshing:
+                    self._refreshing.add(key)
+                    threading.Thread(target=self._refresh, args=(key, refresh or loader), daemon=True).start()
+                return value
+            self.misses += 1
+
+        try:
+            value = loader()
+        except fallback:
+            with self._lock:
+                entry = self._entries.get(key)
+                if entry is None:
+                    raise
+                self.stale_hits += 1
+                return entry[0]
+        self.set(key, value)
+        return value
+
+    def _refresh(self, key, loader):
+        """Reload a stale entry in the background"""
+
+        try:
+            self.set(key, loader())
+        except Exception:
+            pass
+        finally:
+            with self._lock:
+                self._refreshing.discard(key)
+
+    def stats(self):
+        """Counters describing cache usage"""
+
+        with self._lock:
+            return {'entries': len(self._entries),
+                    'bytes': self.nbytes,
+                    'hits': self.hits,
+                    'misses': self.misses,
+                    'stale_hits': self.stale_hits}
+
+
+class SingleFlight:
+    """Collapse concurrent calls for the same key into one
+
+    The first caller for a key runs the function; callers arriving while
+    it is in flight wait for it and share its result or exception.
+    """
+
+    def __init__(self):
+        self._calls = {}
+        self._lock = threading.Lock()
+
+    def do(self, key, fn, timeout=None):
+        """Run fn() once for all concurrent callers with this key
+
+        Waiting callers give up with TimeoutError after `timeout` seconds.
+        """
+
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+
+        if not leader:
+            if not call.done.wait(timeout):
+                raise TimeoutError(f'gave up waiting for {key!r}')
+            if call.error is not None:
+                raise call.error
+            return call.result
+
+        try:
+            call.result = fn()
+            return call.result
+        except Exception as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
+
+
+class _Call:
+    """An in-flight SingleFlight call"""
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
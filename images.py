@@ -0,0 +1,191 @@
+import os
+import hashlib
+import mimetypes
+import tempfile
+import threading
+from io import BytesIO
+from urllib.parse import urlparse, quote
+import requests
+import rawg
+from cache import SingleFlight
+
+try:
+    from PIL import Image
+except ImportError:
+    Image = None
+
+CACHE_DIR = os.environ.get('IMAGE_CACHE_DIR', os.path.join(tempfile.gettempdir(), 'gamey-images'))
+CACHE_BYTES = int(os.environ.get('IMAGE_CACHE_BYTES', 512 * 1024 * 1024))
+FETCH_TIMEOUT = float(os.environ.get('IMAGE_FETCH_TIMEOUT', 10))
+MAX_IMAGE_BYTES = int(os.environ.get('IMAGE_MAX_BYTES', 20 * 1024 * 1024))
+
+ALLOWED_HOSTS = {'media.rawg.io'}
+
+# Largest width and height of each variant; None keeps the original bytes
+VARIANTS = {'thumb': (320, 180),
+            'card': (960, 540),
+            'full': None}
+
+
+class ImageError(Exception):
+    """Image could not be fetched or is not allowed through the proxy"""
+
+
+def is_proxyable(url):
+    """Is url a RAWG media URL the proxy will fetch?"""
+
+    if not url:
+        return False
+    parsed = urlparse(url)
+    return parsed.scheme in ('http', 'https') and parsed.hostname in ALLOWED_HOSTS
+
+def proxied_url(url, variant='thumb'):
+    """Jinja filter pointing a RAWG image URL at the proxy, other URLs unchanged"""
+
+    if not is_proxyable(url):
+        return url
+    return f"/images/{variant}?src={quote(url, safe='')}"
+
+
+class DiskCache:
+    """Directory of image files bounded by total size, evicting least recently used
+
+    Files are touched on every hit so their mtime tracks last use.
+    """
+
+    def __init__(self, directory=CACHE_DIR, max_bytes=CACHE_BYTES):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.nbytes = None
+        self._lock = threading.Lock()
+
+    def path(self, key):
+        return os.path.join(self.directory, key[:2], key)
+
+    def get(self, key):
+        """Path of the cached file for key, or None"""
+
+        path = self.path(key)
+        try:
+            os.utime(path)
+        except FileNotFoundError:
+            return None
+        return path
+
+    def put(self, key, data):
+        """Store data under key and return its path"""
+
+        path = self.path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp = f'{path}.{threading.get_ident()}.tmp'
+        with open(tmp, 'wb') as f:
+            f.write(data)
+        os.replace(tmp, path)
+
+        with self._lock:
+            if self.nbytes is None:
+                self.nbytes = sum(size for path, mtime, size in self._files())
+            else:
+                self.nbytes += len(data)
+            if self.nbytes > self.max_bytes:
+                self._evict()
+        return path
+
+    def _files(self):
+        for root, dirs, files in os.walk(self.directory):
+            for name in files:
+                if name.endswith('.tmp'):
+                    continue
+                path = os.path.join(root, name)
+                try:
+                    stat = os.stat(path)
+                except FileNotFoundError:
+                    continue
+                yield path, stat.st_mtime, stat.st_size
+
+    def _evict(self):
+        """Remove least recently used files until under 90% of the budget"""
+
+        files = sorted(self._files(), key=lambda f: f[1])
+        self.nbytes = sum(size for path, mtime, size in files)
+        for path, mtime, size in files:
+            if self.nbytes <= self.max_bytes * 0.9:
+                break
+            try:
+                os.remove(path)
+                self.nbytes -= size
+            except FileNotFoundError:
+                pass
+
+
+disk_cache = DiskCache()
+
+# Concurrent requests for the same uncached image share one download
+flights = SingleFlight()
+
+def cache_key(url, variant):
+    """Stable file name for one variant of one image"""
+
+    return hashlib.sha1(f'{variant}:{url}'.encode()).hexdigest()
+
+def mimetype(url, variant):
+    """Content type of a stored variant"""
+
+    if VARIANTS[variant] and Image is not None:
+        return 'image/jpeg'
+    return mimetypes.guess_type(urlparse(url).path)[0] or 'image/jpeg'
+
+def download(url):
+    """Bytes of url, refusing bodies larger than MAX_IMAGE_BYTES"""
+
+    with rawg.session.get(url, timeout=FETCH_TIMEOUT, stream=True) as resp:
+        resp.raise_for_status()
+        if int(resp.headers.get('Content-Length') or 0) > MAX_IMAGE_BYTES:
+            raise ImageError(f'{url} is larger than {MAX_IMAGE_BYTES} bytes')
+        data = bytearray()
+        for chunk in resp.iter_content(64 * 1024):
+            data.extend(chunk)
+            if len(data) > MAX_IMAGE_BYTES:
+                raise ImageError(f'{url} is larger than {MAX_IMAGE_BYTES} bytes')
+    return bytes(data)
+
+def resize(data, size):
+    """Shrink image bytes to fit size as a JPEG; unchanged without Pillow"""
+
+    if size is None or Image is None:
+        return data
+    try:
+        image = Image.open(BytesIO(data))
+        image.thumbnail(size)
+        out = BytesIO()
+        image.convert('RGB').save(out, 'JPEG', quality=80, optimize=True)
+    except Exception as e:
+        # Corrupt or hostile files fail in many ways, DecompressionBombError included
+        raise ImageError(f'could not resize image: {e}') from e
+    return out.getvalue()
+
+def get_image(url, variant):
+    """Return (path, key) of the cached variant, fetching it on a miss"""
+
+    if variant not in VARIANTS or not is_proxyable(url):
+        raise ImageError(f'{variant} of {url} is not available through the proxy')
+
+    key = cache_key(url, variant)
+    path = disk_cache.get(key)
+    if path:
+        return path, key
+
+    def load():
+        try:
+            if VARIANTS[variant] is None:
+                data = download(url)
+            else:
+                # Resize from the cached original so RAWG is hit once per image
+                original, original_key = get_image(url, 'full')
+                with open(original, 'rb') as f:
+                    data = resize(f.read(), VARIANTS[variant])
+        except (requests.RequestException, OSError) as e:
+            raise ImageError(str(e)) from e
+        return disk_cache.put(key, data)
+
+    return flights.do(key, load), key
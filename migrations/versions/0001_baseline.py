@@ -0,0 +1,90 @@
+"""baseline schema
+
+Databases created earlier with db.create_all() match this revision and
+only need `flask db stamp 0001`.
+
+Revision ID: 0001
+Revises: 
+Create Date: 2021-02-01 12:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '0001'
+down_revision = None
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('games',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('name', sa.String(), nullable=False),
+        sa.Column('background_image', sa.String(), nullable=True),
+        sa.PrimaryKeyConstraint('id')
+    )
+    op.create_table('users',
+        sa.Column('username', sa.String(length=20), nullable=False),
+        sa.Column('password', sa.String(), nullable=False),
+        sa.Column('email', sa.String(length=30), nullable=False),
+        sa.Column('first_name', sa.String(length=20), nullable=False),
+        sa.Column('last_name', sa.String(length=20), nullable=False),
+        sa.Column('bio', sa.String(), nullable=True),
+        sa.Column('image_url', sa.String(), nullable=False),
+        sa.PrimaryKeyConstraint('username')
+    )
+    op.create_table('questions',
+        sa.Column('id', sa.Integer(), autoincrement=True, nullable=False),
+        sa.Column('title', sa.String(length=50), nullable=False),
+        sa.Column('text', sa.String(), nullable=False),
+        sa.Column('timestamp', sa.TIMESTAMP(), nullable=False),
+        sa.Column('game_id', sa.Integer(), nullable=False),
+        sa.Column('username', sa.String(), nullable=True),
+        sa.ForeignKeyConstraint(['game_id'], ['games.id'], ondelete='CASCADE'),
+        sa.ForeignKeyConstraint(['username'], ['users.username'], ondelete='SET NULL'),
+        sa.PrimaryKeyConstraint('id')
+    )
+    op.create_table('reviews',
+        sa.Column('id', sa.Integer(), autoincrement=True, nullable=False),
+        sa.Column('title', sa.String(length=50), nullable=False),
+        sa.Column('rating', sa.Float(), nullable=False),
+        sa.Column('text', sa.String(), nullable=False),
+        sa.Column('timestamp', sa.TIMESTAMP(), nullable=False),
+        sa.Column('game_id', sa.Integer(), nullable=False),
+        sa.Column('username', sa.String(), nullable=True),
+        sa.ForeignKeyConstraint(['game_id'], ['games.id'], ondelete='CASCADE'),
+        sa.ForeignKeyConstraint(['username'], ['users.username'], ondelete='SET NULL'),
+        sa.PrimaryKeyConstraint('id')
+    )
+    op.create_table('answers',
+        sa.Column('id', sa.Integer(), autoincrement=True, nullable=False),
+        sa.Column('text', sa.String(), nullable=False),
+        sa.Column('timestamp', sa.TIMESTAMP(), nullable=False),
+        sa.Column('question_id', sa.Integer(), nullable=False),
+        sa.Column('username', sa.String(), nullable=True),
+        sa.ForeignKeyConstraint(['question_id'], ['questions.id'], ondelete='CASCADE'),
+        sa.ForeignKeyConstraint(['username'], ['users.username'], ondelete='SET NULL'),
+        sa.PrimaryKeyConstraint('id')
+    )
+    op.create_table('upvotes',
+        sa.Column('id', sa.Integer(), autoincrement=True, nullable=False),
+        sa.Column('username', sa.String(), nullable=True),
+        sa.Column('review_id', sa.Integer(), nullable=True),
+        sa.Column('answer_id', sa.Integer(), nullable=True),
+        sa.ForeignKeyConstraint(['answer_id'], ['answers.id'], ondelete='CASCADE'),
+        sa.ForeignKeyConstraint(['review_id'], ['reviews.id'], ondelete='CASCADE'),
+        sa.ForeignKeyConstraint(['username'], ['users.username'], ondelete='SET NULL'),
+        sa.PrimaryKeyConstraint('id')
+    )
+
+
+def downgrade():
+    op.drop_table('upvotes')
+    op.drop_table('answers')
+    op.drop_table('reviews')
+    op.drop_table('questions')
+    op.drop_table('users')
+    op.drop_table('games')
@@ -0,0 +1,66 @@
+"""game snapshots, denormalized counters and local search indexes
+
+Revision ID: 0002
+Revises: 0001
+Create Date: 2021-02-01 12:05:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+
+
+# revision identifiers, used by Alembic.
+revision = '0002'
+down_revision = '0001'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.add_column('games', sa.Column('released', sa.String(), nullable=True))
+    op.add_column('games', sa.Column('website', sa.String(), nullable=True))
+    op.add_column('games', sa.Column('esrb_rating', sa.String(), nullable=True))
+    op.add_column('games', sa.Column('platforms', postgresql.ARRAY(sa.String()), nullable=True))
+    op.add_column('games', sa.Column('description', sa.Text(), nullable=True))
+    op.add_column('games', sa.Column('fetched_at', sa.TIMESTAMP(), nullable=True))
+    op.add_column('games', sa.Column('rating_count', sa.Integer(), server_default='0', nullable=False))
+    op.add_column('games', sa.Column('rating_sum', sa.Float(), server_default='0', nullable=False))
+    op.add_column('reviews', sa.Column('upvote_count', sa.Integer(), server_default='0', nullable=False))
+    op.add_column('answers', sa.Column('upvote_count', sa.Integer(), server_default='0', nullable=False))
+    op.add_column('questions', sa.Column('answer_count', sa.Integer(), server_default='0', nullable=False))
+
+    # Same backfill as `flask reconcile-counts`
+    op.execute("UPDATE reviews SET upvote_count = "
+               "(SELECT count(*) FROM upvotes WHERE upvotes.review_id = reviews.id)")
+    op.execute("UPDATE answers SET upvote_count = "
+               "(SELECT count(*) FROM upvotes WHERE upvotes.answer_id = answers.id)")
+    op.execute("UPDATE questions SET answer_count = "
+               "(SELECT count(*) FROM answers WHERE answers.question_id = questions.id)")
+    op.execute("UPDATE games SET "
+               "rating_count = (SELECT count(*) FROM reviews WHERE reviews.game_id = games.id), "
+               "rating_sum = (SELECT coalesce(sum(rating), 0) FROM reviews WHERE reviews.game_id = games.id)")
+
+    op.execute('CREATE EXTENSION IF NOT EXISTS pg_trgm')
+    op.create_index('ix_games_search', 'games',
+                    [sa.text("to_tsvector('english', coalesce(name, '') || ' ' || coalesce(description, ''))")],
+                    postgresql_using='gin')
+    op.create_index('ix_games_name_trgm', 'games', ['name'],
+                    postgresql_using='gin',
+                    postgresql_ops={'name': 'gin_trgm_ops'})
+
+
+def downgrade():
+    op.drop_index('ix_games_name_trgm', table_name='games')
+    op.drop_index('ix_games_search', table_name='games')
+    op.drop_column('questions', 'answer_count')
+    op.drop_column('answers', 'upvote_count')
+    op.drop_column('reviews', 'upvote_count')
+    op.drop_column('games', 'rating_sum')
+    op.drop_column('games', 'rating_count')
+    op.drop_column('games', 'fetched_at')
+    op.drop_column('games', 'description')
+    op.drop_column('games', 'platforms')
+    op.drop_column('games', 'esrb_rating')
+    op.drop_column('games', 'website')
+    op.drop_column('games', 'released')
@@ -0,0 +1,40 @@
+"""index foreign keys and newest-first list pages
+
+Revision ID: 0003
+Revises: 0002
+Create Date: 2021-02-01 12:10:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '0003'
+down_revision = '0002'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_index('ix_reviews_game_id_id', 'reviews', ['game_id', sa.text('id DESC')])
+    op.create_index('ix_reviews_username_id', 'reviews', ['username', sa.text('id DESC')])
+    op.create_index('ix_questions_game_id_id', 'questions', ['game_id', sa.text('id DESC')])
+    op.create_index('ix_questions_username_id', 'questions', ['username', sa.text('id DESC')])
+    op.create_index(op.f('ix_answers_question_id'), 'answers', ['question_id'])
+    op.create_index(op.f('ix_answers_username'), 'answers', ['username'])
+    op.create_index(op.f('ix_upvotes_username'), 'upvotes', ['username'])
+    op.create_index(op.f('ix_upvotes_review_id'), 'upvotes', ['review_id'])
+    op.create_index(op.f('ix_upvotes_answer_id'), 'upvotes', ['answer_id'])
+
+
+def downgrade():
+    op.drop_index(op.f('ix_upvotes_answer_id'), table_name='upvotes')
+    op.drop_index(op.f('ix_upvotes_review_id'), table_name='upvotes')
+    op.drop_index(op.f('ix_upvotes_username'), table_name='upvotes')
+    op.drop_index(op.f('ix_answers_username'), table_name='answers')
+    op.drop_index(op.f('ix_answers_question_id'), table_name='answers')
+    op.drop_index('ix_questions_username_id', table_name='questions')
+    op.drop_index('ix_questions_game_id_id', table_name='questions')
+    op.drop_index('ix_reviews_username_id', table_name='reviews')
+    op.drop_index('ix_reviews_game_id_id', table_name='reviews')
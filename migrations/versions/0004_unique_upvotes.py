@@ -0,0 +1,39 @@
+"""one upvote per user and post
+
+Revision ID: 0004
+Revises: 0003
+Create Date: 2021-02-01 12:15:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '0004'
+down_revision = '0003'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # Drop repeat upvotes left by double clicks, keeping the first, and
+    # recount the posts they were counted against
+    op.execute("DELETE FROM upvotes a USING upvotes b "
+               "WHERE a.id > b.id AND a.username = b.username "
+               "AND (a.review_id = b.review_id OR a.answer_id = b.answer_id)")
+    op.execute("UPDATE reviews SET upvote_count = "
+               "(SELECT count(*) FROM upvotes WHERE upvotes.review_id = reviews.id)")
+    op.execute("UPDATE answers SET upvote_count = "
+               "(SELECT count(*) FROM upvotes WHERE upvotes.answer_id = answers.id)")
+
+    op.create_unique_constraint('uq_upvotes_username_review_id', 'upvotes', ['username', 'review_id'])
+    op.create_unique_constraint('uq_upvotes_username_answer_id', 'upvotes', ['username', 'answer_id'])
+    # Both constraints lead with username, so its own index is redundant
+    op.drop_index(op.f('ix_upvotes_username'), table_name='upvotes')
+
+
+def downgrade():
+    op.create_index(op.f('ix_upvotes_username'), 'upvotes', ['username'])
+    op.drop_constraint('uq_upvotes_username_answer_id', 'upvotes', type_='unique')
+    op.drop_constraint('uq_upvotes_username_review_id', 'upvotes', type_='unique')
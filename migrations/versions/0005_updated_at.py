@@ -0,0 +1,26 @@
+"""updated_at stamps for conditional GET
+
+Revision ID: 0005
+Revises: 0004
+Create Date: 2021-02-01 12:20:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '0005'
+down_revision = '0004'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    for table in ('games', 'reviews', 'questions', 'answers'):
+        op.add_column(table, sa.Column('updated_at', sa.TIMESTAMP(), server_default=sa.text('now()'), nullable=False))
+
+
+def downgrade():
+    for table in ('answers', 'questions', 'reviews', 'games'):
+        op.drop_column(table, 'updated_at')
@@ -1,9 +1,26 @@
+import os
+from concurrent.futures import ThreadPoolExecutor, TimeoutError
+from datetime import datetime
+from functools import lru_cache
 from flask_sqlalchemy import SQLAlchemy
 from flask_bcrypt import Bcrypt
+from sqlalchemy.dialects.postgresql import insert
 
 bcrypt = Bcrypt()
 db = SQLAlchemy()
 
+# Cost factor for new hashes; stored hashes at another cost are upgraded at login
+BCRYPT_LOG_ROUNDS = int(os.environ.get('BCRYPT_LOG_ROUNDS', 12))
+# One core is left for serving pages: with a worker per core, a burst of
+# logins holds every core for the length of its queue.  More workers clear
+# the burst sooner; fewer keep other pages responsive while it lasts.
+BCRYPT_WORKERS = int(os.environ.get('BCRYPT_WORKERS', max(1, (os.cpu_count() or 2) - 1)))
+BCRYPT_TIMEOUT = float(os.environ.get('BCRYPT_TIMEOUT', 10))
+
+# bcrypt releases the GIL, so hashes run in parallel here while the number
+# in flight stays bounded however many logins arrive at once
+hash_pool = ThreadPoolExecutor(max_workers=BCRYPT_WORKERS, thread_name_prefix='bcrypt')
+
 
 def connect_db(app):
     """Connect to database."""
@@ -11,25 +28,180 @@ def connect_db(app):
     db.app = app
     db.init_app(app)
 
+class HashBusy(Exception):
+    """A password hash waited longer than BCRYPT_TIMEOUT for the pool"""
+
+def run_hash(fn, *args):
+    """Run a bcrypt call on hash_pool, raising HashBusy if it takes too long
+
+    A call still queued when the timeout passes is cancelled, so it
+    does not hold up the logins behind it.
+    """
+
+    future = hash_pool.submit(fn, *args)
+    try:
+        return future.result(BCRYPT_TIMEOUT)
+    except TimeoutError:
+        future.cancel()
+        raise HashBusy()
+
 def get_hashed_pwd(password):
     """Use bcrypt to hash given password"""
 
-    hashed_pwd = bcrypt.generate_password_hash(password).decode('UTF-8')
+    hashed_pwd = run_hash(bcrypt.generate_password_hash, password, BCRYPT_LOG_ROUNDS).decode('UTF-8')
     return hashed_pwd
 
-def readable_times(objs):
-    """Display timestamps in readable format for list of objects"""
-    
-    for obj in objs:
-        readable_time(obj)
-    return objs
-
-def readable_time(obj):
-    """Display timestamp in readable format for single object"""
-
-    format_time = "%m/%d/%y  %I:%M %p"
-    obj.timestamp = obj.timestamp.strftime(format_time)
-    return obj
+def check_pwd(hashed_pwd, password):
+    """Use bcrypt to check password against a stored hash"""
+
+    return run_hash(bcrypt.check_password_hash, hashed_pwd, password)
+
+def needs_rehash(hashed_pwd):
+    """Was the stored hash made at a different cost than BCRYPT_LOG_ROUNDS?"""
+
+    # Hashes look like $2b$12$<salt and digest>
+    return int(hashed_pwd.split('$')[2]) != BCRYPT_LOG_ROUNDS
+
+def increment(column, id, by=1):
+    """Add to a counter column of the row with this id in a single UPDATE"""
+
+    column.class_.query.filter_by(id=id).update({column: column + by},
+                                                synchronize_session=False)
+
+def add_upvote(model, id, username):
+    """Upvote the Review or Answer with this id as username
+
+    A single INSERT ... ON CONFLICT DO NOTHING that also skips the author's
+    own posts, so nothing is loaded first.  The counter only moves when a
+    row went in.  Returns (added, upvote_count); the count is None when
+    there is no such row.
+    """
+
+    column = Upvote.review_id if model is Review else Upvote.answer_id
+    target = (db.select([db.literal(username), model.id])
+                .where(model.id == id)
+                .where(model.username.is_distinct_from(username)))
+    added = db.session.execute(insert(Upvote)
+                                 .from_select([Upvote.username, column], target)
+                                 .on_conflict_do_nothing()).rowcount
+    return bool(added), upvote_count(model, id, added)
+
+def remove_upvote(model, id, username):
+    """Take back username's upvote on the Review or Answer with this id
+
+    Returns (removed, upvote_count) like add_upvote.
+    """
+
+    column = Upvote.review_id if model is Review else Upvote.answer_id
+    removed = (Upvote.query.filter(column == id, Upvote.username == username)
+                           .delete(synchronize_session=False))
+    return bool(removed), upvote_count(model, id, -removed)
+
+def toggle_upvote(model, id, username):
+    """Remove username's upvote if there is one, otherwise add it
+
+    Returns (upvoted, upvote_count).
+    """
+
+    removed, count = remove_upvote(model, id, username)
+    if removed:
+        return False, count
+    return add_upvote(model, id, username)
+
+def upvoted_ids(column, ids, username):
+    """Which of these review or answer ids username has upvoted
+
+    column is Upvote.review_id or Upvote.answer_id.  Only the user's
+    upvotes on the given ids are read, through the unique constraint.
+    """
+
+    if not username or not ids:
+        return set()
+    return {id for id, in db.session.query(column).filter(Upvote.username == username,
+                                                          column.in_(ids))}
+
+def upvote_count(model, id, by=0):
+    """Move the upvote counter of a Review or Answer by `by` and return it"""
+
+    if not by:
+        return db.session.query(model.upvote_count).filter_by(id=id).scalar()
+    return db.session.execute(model.__table__.update()
+                                .where(model.id == id)
+                                .values(upvote_count=model.upvote_count + by)
+                                .returning(model.upvote_count)).scalar()
+
+def reconcile_counts():
+    """Recompute every denormalized counter from the underlying rows"""
+
+    Review.query.update({Review.upvote_count:
+                            db.session.query(db.func.count(Upvote.id))
+                                      .filter(Upvote.review_id == Review.id)
+                                      .as_scalar()},
+                        synchronize_session=False)
+    Answer.query.update({Answer.upvote_count:
+                            db.session.query(db.func.count(Upvote.id))
+                                      .filter(Upvote.answer_id == Answer.id)
+                                      .as_scalar()},
+                        synchronize_session=False)
+    Question.query.update({Question.answer_count:
+                            db.session.query(db.func.count(Answer.id))
+                                      .filter(Answer.question_id == Question.id)
+                                      .as_scalar()},
+                          synchronize_session=False)
+    Game.query.update({Game.rating_count:
+                            db.session.query(db.func.count(Review.id))
+                                      .filter(Review.game_id == Game.id)
+                                      .as_scalar(),
+                       Game.rating_sum:
+                            db.session.query(db.func.coalesce(db.func.sum(Review.rating), 0))
+                                      .filter(Review.game_id == Game.id)
+                                      .as_scalar()},
+                      synchronize_session=False)
+
+def keyset_page(query, column, before=None, per_page=20):
+    """One page of query newest first, with the cursor for the next page
+
+    Only rows with column below `before` are read, so every page costs
+    one indexed range scan however deep it is.  Returns (items, cursor),
+    where cursor is None on the last page.
+    """
+
+    if before is not None:
+        query = query.filter(column < before)
+    items = query.order_by(column.desc()).limit(per_page + 1).all()
+    if len(items) > per_page:
+        items = items[:per_page]
+        return items, getattr(items[-1], column.key)
+    return items, None
+
+def unindexed_foreign_keys(metadata=None):
+    """List 'table(columns)' for each foreign key no index or key leads with
+
+    Postgres does not index the referencing side of a foreign key, so
+    without one every relationship load and cascading delete scans the
+    whole table.
+    """
+
+    metadata = metadata or db.metadata
+    missing = []
+    for table in metadata.sorted_tables:
+        leading = [tuple(index.columns) for index in table.indexes]
+        leading += [tuple(constraint.columns) for constraint in table.constraints
+                    if isinstance(constraint, (db.PrimaryKeyConstraint, db.UniqueConstraint))]
+        for fk in table.foreign_key_constraints:
+            columns = tuple(fk.columns)
+            if not any(cols[:len(columns)] == columns for cols in leading):
+                missing.append(f"{table.name}({', '.join(c.name for c in columns)})")
+    return missing
+
+@lru_cache(maxsize=4096)
+def readable_time(timestamp):
+    """Jinja filter displaying a timestamp in readable format
+
+    Formatting happens at render time so ORM objects are never modified.
+    """
+
+    return timestamp.strftime("%m/%d/%y  %I:%M %p")
 
 
 class Upvote(db.Model):
@@ -37,6 +209,10 @@ class Upvote(db.Model):
 
     __tablename__ = 'upvotes'
 
+    # One upvote per user and post; these also index upvotes.username
+    __table_args__ = (db.UniqueConstraint('username', 'review_id', name='uq_upvotes_username_review_id'),
+                      db.UniqueConstraint('username', 'answer_id', name='uq_upvotes_username_answer_id'))
+
     id = db.Column(db.Integer,
                     primary_key=True,
                     autoincrement=True)
@@ -45,10 +221,12 @@ class Upvote(db.Model):
                     db.ForeignKey('users.username', ondelete='SET NULL'))
 
     review_id = db.Column(db.Integer,
-                    db.ForeignKey('reviews.id', ondelete='CASCADE'))
+                    db.ForeignKey('reviews.id', ondelete='CASCADE'),
+                    index=True)
     
     answer_id = db.Column(db.Integer,
-                    db.ForeignKey('answers.id', ondelete='CASCADE'))
+                    db.ForeignKey('answers.id', ondelete='CASCADE'),
+                    index=True)
 
 
 class Review(db.Model):
@@ -80,6 +258,18 @@ class Review(db.Model):
     username = db.Column(db.String,
                     db.ForeignKey('users.username', ondelete='SET NULL'))
 
+    upvote_count = db.Column(db.Integer,
+                    nullable=False,
+                    default=0,
+                    server_default='0')
+
+    # Bumped by every UPDATE, including counter increments; feeds page ETags
+    updated_at = db.Column(db.TIMESTAMP,
+                    nullable=False,
+                    default=db.func.now(),
+                    onupdate=db.func.now(),
+                    server_default=db.func.now())
+
 
     upvotes = db.relationship('Upvote', backref='review', cascade='all, delete')
 
@@ -102,10 +292,23 @@ class Answer(db.Model):
 
     question_id = db.Column(db.Integer,
                     db.ForeignKey('questions.id', ondelete='CASCADE'),
-                    nullable=False)
+                    nullable=False,
+                    index=True)
     
     username = db.Column(db.String,
-                    db.ForeignKey('users.username', ondelete='SET NULL'))
+                    db.ForeignKey('users.username', ondelete='SET NULL'),
+                    index=True)
+
+    upvote_count = db.Column(db.Integer,
+                    nullable=False,
+                    default=0,
+                    server_default='0')
+
+    updated_at = db.Column(db.TIMESTAMP,
+                    nullable=False,
+                    default=db.func.now(),
+                    onupdate=db.func.now(),
+                    server_default=db.func.now())
 
 
     upvotes = db.relationship('Upvote', backref='answer', cascade='all, delete')
@@ -138,6 +341,17 @@ class Question(db.Model):
     username = db.Column(db.String,
                     db.ForeignKey('users.username', ondelete='SET NULL'))
 
+    answer_count = db.Column(db.Integer,
+                    nullable=False,
+                    default=0,
+                    server_default='0')
+
+    updated_at = db.Column(db.TIMESTAMP,
+                    nullable=False,
+                    default=db.func.now(),
+                    onupdate=db.func.now(),
+                    server_default=db.func.now())
+
 
     answers = db.relationship('Answer', backref='question', cascade='all, delete')
 
@@ -200,14 +414,20 @@ class User(db.Model):
         return user
 
     @classmethod
-    def authenticate(cls, username, password):
-        """Authenticate user, or return False"""
+    def authenticate(cls, username, password, rehash=True):
+        """Authenticate user, or return False
+
+        With rehash, a password stored at an old cost is hashed again at
+        BCRYPT_LOG_ROUNDS; the caller commits it.
+        """
 
         user = cls.query.filter_by(username=username).first()
 
         if user:
-            is_auth = bcrypt.check_password_hash(user.password, password)
+            is_auth = check_pwd(user.password, password)
             if is_auth:
+                if rehash and needs_rehash(user.password):
+                    user.password = get_hashed_pwd(password)
                 return user
 
         return False
@@ -226,6 +446,37 @@ class Game(db.Model):
 
     background_image = db.Column(db.String)
 
+    # Snapshot of the RAWG fields shown on the info page
+    released = db.Column(db.String)
+
+    website = db.Column(db.String)
+
+    esrb_rating = db.Column(db.String)
+
+    platforms = db.Column(db.ARRAY(db.String))
+
+    description = db.Column(db.Text)
+
+    fetched_at = db.Column(db.TIMESTAMP)
+
+    # Running totals of review ratings, kept by the review routes
+    rating_count = db.Column(db.Integer,
+                    nullable=False,
+                    default=0,
+                    server_default='0')
+
+    rating_sum = db.Column(db.Float,
+                    nullable=False,
+                    default=0,
+                    server_default='0')
+
+    # Bumped when the snapshot or rating totals change
+    updated_at = db.Column(db.TIMESTAMP,
+                    nullable=False,
+                    default=db.func.now(),
+                    onupdate=db.func.now(),
+                    server_default=db.func.now())
+
 
     reviews = db.relationship('Review', backref='game', cascade='all, delete')
 
@@ -242,3 +493,71 @@ class Game(db.Model):
         db.session.add(new_game)
         return new_game
 
+    def update_snapshot(self, game_api_data):
+        """Copy displayed fields from a rawg.GameDetail and stamp fetch time"""
+
+        self.name = game_api_data.name
+        self.background_image = game_api_data.background_image
+        self.released = game_api_data.released
+        self.website = game_api_data.website
+        self.esrb_rating = game_api_data.esrb_rating
+        self.platforms = list(game_api_data.platforms)
+        self.description = game_api_data.description
+        self.fetched_at = datetime.utcnow()
+
+    @property
+    def average_rating(self):
+        """Mean review rating to two places, or None without reviews"""
+
+        if not self.rating_count:
+            return None
+        return round(self.rating_sum / self.rating_count, 2)
+
+    def is_stale(self, max_age):
+        """Has the snapshot never been fetched, or is it older than max_age seconds"""
+
+        if self.fetched_at is None:
+            return True
+        return (datetime.utcnow() - self.fetched_at).total_seconds() > max_age
+
+    @classmethod
+    def search(cls, query, limit=20):
+        """Games already in the database matching query, best matches first
+
+        Matches words in the name or description through the full-text
+        index, or any part of the name through the trigram index.  A blank
+        query matches nothing.
+        """
+
+        query = query.strip()
+        if not query:
+            return []
+        pattern = '%' + query.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_') + '%'
+        return (cls.query
+                   .filter(db.or_(game_search_vector.op('@@')(db.func.plainto_tsquery('english', query)),
+                                  cls.name.ilike(pattern)))
+                   .order_by(db.func.similarity(cls.name, query).desc(), cls.id)
+                   .limit(limit)
+                   .all())
+
+
+# Full-text and trigram indexes backing Game.search
+game_search_vector = db.func.to_tsvector('english',
+    db.func.coalesce(Game.name, '') + ' ' + db.func.coalesce(Game.description, ''))
+
+db.Index('ix_games_search', game_search_vector, postgresql_using='gin')
+
+db.Index('ix_games_name_trgm', Game.name,
+         postgresql_using='gin',
+         postgresql_ops={'name': 'gin_trgm_ops'})
+
+db.event.listen(db.metadata, 'before_create', db.DDL('CREATE EXTENSION IF NOT EXISTS pg_trgm'))
+
+# Newest-first list pages filter on one of these and page backwards by id
+db.Index('ix_reviews_game_id_id', Review.game_id, Review.id.desc())
+
+db.Index('ix_reviews_username_id', Review.username, Review.id.desc())
+
+db.Index('ix_questions_game_id_id', Question.game_id, Question.id.desc())
+
+db.Index('ix_questions_username_id', Question.username, Question.id.desc())
@@ -0,0 +1,468 @@
+import os
+import re
+import sys
+import time
+import threading
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, wait
+import requests
+from requests.adapters import HTTPAdapter
+from cache import TTLCache, SingleFlight
+
+try:
+    from orjson import loads
+except ImportError:
+    from json import loads
+
+#BASE_URL = "https://rawg-video-games-database.p.rapidapi.com/games"
+BASE_URL = 'https://api.rawg.io/api/games'
+API_KEY = os.environ.get('API_KEY')
+
+POOL_SIZE = int(os.environ.get('RAWG_POOL_SIZE', 10))
+CONNECT_TIMEOUT = float(os.environ.get('RAWG_CONNECT_TIMEOUT', 3.05))
+READ_TIMEOUT = float(os.environ.get('RAWG_READ_TIMEOUT', 10))
+RETRIES = int(os.environ.get('RAWG_RETRIES', 2))
+BACKOFF = float(os.environ.get('RAWG_BACKOFF', 0.3))
+
+RATE = float(os.environ.get('RAWG_RATE', 5))
+BURST = int(os.environ.get('RAWG_BURST', 10))
+DAILY_QUOTA = int(os.environ.get('RAWG_DAILY_QUOTA', 20000))
+QUEUE_WAIT = float(os.environ.get('RAWG_QUEUE_WAIT', 0.5))
+
+BREAKER_WINDOW = int(os.environ.get('RAWG_BREAKER_WINDOW', 20))
+BREAKER_MIN_CALLS = int(os.environ.get('RAWG_BREAKER_MIN_CALLS', 5))
+BREAKER_FAILURE_RATE = float(os.environ.get('RAWG_BREAKER_FAILURE_RATE', 0.5))
+BREAKER_RESET = float(os.environ.get('RAWG_BREAKER_RESET', 30))
+
+GAME_CACHE_TTL = int(os.environ.get('RAWG_GAME_CACHE_TTL', 60 * 60))
+GAME_CACHE_STALE = int(os.environ.get('RAWG_GAME_CACHE_STALE', 24 * 60 * 60))
+GAME_CACHE_ENTRIES = int(os.environ.get('RAWG_GAME_CACHE_ENTRIES', 2000))
+GAME_CACHE_BYTES = int(os.environ.get('RAWG_GAME_CACHE_BYTES', 64 * 1024 * 1024))
+
+SEARCH_CACHE_TTL = int(os.environ.get('RAWG_SEARCH_CACHE_TTL', 60 * 60))
+SEARCH_CACHE_ENTRIES = int(os.environ.get('RAWG_SEARCH_CACHE_ENTRIES', 5000))
+
+
+class RawgError(Exception):
+    """RAWG could not be reached or returned an error"""
+
+
+class RawgNotFound(RawgError):
+    """RAWG has nothing at the requested path"""
+
+
+class RawgUnavailable(RawgError):
+    """RAWG is down, or was skipped because the breaker is open or time ran out"""
+
+
+class RawgRateLimited(RawgUnavailable):
+    """Our own request quota or RAWG's is used up"""
+
+
+class RateLimiter:
+    """Token bucket shared by every thread, plus a daily call quota
+
+    Tokens refill at `rate` per second up to `burst`.  Each RAWG call
+    takes one token and counts against `daily_quota`, which resets at
+    midnight UTC.  No tokens are handed out during a `pause`.
+    """
+
+    def __init__(self, rate=RATE, burst=BURST, daily_quota=DAILY_QUOTA):
+        self.rate = rate
+        self.burst = burst
+        self.daily_quota = daily_quota
+        self.tokens = burst
+        self.used_today = 0
+        self.rejected_today = 0
+        self.paused_until = 0
+        self.day = datetime.utcnow().date()
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.burst, self.tokens + (now - self._updated) * self.rate)
+        self._updated = now
+        today = datetime.utcnow().date()
+        if today != self.day:
+            self.day = today
+            self.used_today = 0
+            self.rejected_today = 0
+
+    def acquire(self, timeout=0):
+        """Take a token, waiting up to timeout seconds; False if none came"""
+
+        give_up = time.monotonic() + timeout
+        while True:
+            with self._lock:
+                self._refill()
+                if self.used_today >= self.daily_quota or time.monotonic() < self.paused_until:
+                    self.rejected_today += 1
+                    return False
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    self.used_today += 1
+                    return True
+                wait_for = (1 - self.tokens) / self.rate
+            if time.monotonic() + wait_for > give_up:
+                with self._lock:
+                    self.rejected_today += 1
+                return False
+            time.sleep(wait_for)
+
+    def release(self):
+        """Return a token taken by acquire for a call that was never made"""
+
+        with self._lock:
+            self.tokens = min(self.burst, self.tokens + 1)
+            self.used_today = max(0, self.used_today - 1)
+
+    def pause(self, seconds):
+        """Refuse every call for the next seconds, as RAWG asked us to"""
+
+        with self._lock:
+            self.paused_until = max(self.paused_until, time.monotonic() + seconds)
+
+    def usage(self):
+        """Current quota usage"""
+
+        with self._lock:
+            self._refill()
+            return {'rate': self.rate,
+                    'burst': self.burst,
+                    'tokens': round(self.tokens, 2),
+                    'daily_quota': self.daily_quota,
+                    'used_today': self.used_today,
+                    'rejected_today': self.rejected_today,
+                    'paused_for': round(max(0, self.paused_until - time.monotonic()), 2)}
+
+
+class CircuitBreaker:
+    """Stop calling RAWG while too many recent calls have failed
+
+    Closed: calls go through and their outcomes are recorded.  Once at
+    least `min_calls` of the last `window` calls are recorded and the
+    failure rate reaches `failure_rate`, the breaker opens and rejects
+    calls for `reset_timeout` seconds.  It then goes half-open and lets a
+    single trial call through, closing on success and re-opening on
+    failure.
+    """
+
+    CLOSED = 'closed'
+    OPEN = 'open'
+    HALF_OPEN = 'half-open'
+
+    def __init__(self, window=BREAKER_WINDOW, min_calls=BREAKER_MIN_CALLS,
+                 failure_rate=BREAKER_FAILURE_RATE, reset_timeout=BREAKER_RESET):
+        self.min_calls = min_calls
+        self.failure_rate = failure_rate
+        self.reset_timeout = reset_timeout
+        self.state = self.CLOSED
+        self.opened_at = 0
+        self._results = deque(maxlen=window)
+        self._trial_running = False
+        self._lock = threading.Lock()
+
+    def is_open(self):
+        """Would allow() refuse right now?  Unlike allow(), claims no trial call"""
+
+        with self._lock:
+            if self.state == self.OPEN:
+                return time.monotonic() - self.opened_at < self.reset_timeout
+            return self.state == self.HALF_OPEN and self._trial_running
+
+    def allow(self):
+        """May a call go through right now?"""
+
+        with self._lock:
+            if self.state == self.OPEN:
+                if time.monotonic() - self.opened_at < self.reset_timeout:
+                    return False
+                self.state = self.HALF_OPEN
+            if self.state == self.HALF_OPEN:
+                if self._trial_running:
+                    return False
+                self._trial_running = True
+            return True
+
+    def record(self, success):
+        """Record the outcome of a call let through by allow()"""
+
+        with self._lock:
+            if self.state == self.HALF_OPEN:
+                self._trial_running = False
+                if success:
+                    self.state = self.CLOSED
+                    self._results.clear()
+                else:
+                    self._open()
+                return
+            self._results.append(success)
+            failures = self._results.count(False)
+            if (len(self._results) >= self.min_calls and
+                    failures / len(self._results) >= self.failure_rate):
+                self._open()
+
+    def _open(self):
+        self.state = self.OPEN
+        self.opened_at = time.monotonic()
+        self._results.clear()
+
+
+class GameDetail:
+    """The fields of a RAWG game that we store or display"""
+
+    __slots__ = ('id', 'name', 'background_image', 'released', 'website',
+                 'esrb_rating', 'platforms', 'description')
+
+    def __init__(self, id, name, background_image=None, released=None, website=None,
+                 esrb_rating=None, platforms=(), description=None):
+        self.id = id
+        self.name = name
+        self.background_image = background_image
+        self.released = released
+        self.website = website
+        self.esrb_rating = esrb_rating
+        self.platforms = platforms
+        self.description = description
+
+    @classmethod
+    def from_api(cls, data):
+        """Project a full RAWG game payload down to the fields we use"""
+
+        esrb_rating = data.get('esrb_rating')
+        return cls(id=data['id'],
+                   name=data['name'],
+                   background_image=data.get('background_image'),
+                   released=data.get('released'),
+                   website=data.get('website'),
+                   esrb_rating=esrb_rating['name'] if esrb_rating else None,
+                   platforms=platform_names(data),
+                   description=data.get('description'))
+
+
+class SearchResult:
+    """The fields of a RAWG search result shown on games/results.html"""
+
+    __slots__ = ('id', 'name', 'background_image', 'platforms')
+
+    def __init__(self, id, name, background_image=None, platforms=()):
+        self.id = id
+        self.name = name
+        self.background_image = background_image
+        self.platforms = platforms
+
+    @classmethod
+    def from_api(cls, data):
+        """Project one RAWG search result down to the fields we use"""
+
+        return cls(id=data['id'],
+                   name=data['name'],
+                   background_image=data.get('background_image'),
+                   platforms=platform_names(data))
+
+
+def platform_names(data):
+    """Tuple of platform names from a RAWG payload"""
+
+    return tuple(sys.intern(p['platform']['name']) for p in data.get('platforms') or ())
+
+def sizeof(obj):
+    """Approximate memory held by a projected GameDetail or SearchResult"""
+
+    size = sys.getsizeof(obj)
+    for slot in obj.__slots__:
+        size += sys.getsizeof(getattr(obj, slot))
+    return size
+
+def make_session(pool_size=POOL_SIZE):
+    """Build a keep-alive session with a connection pool"""
+
+    adapter = HTTPAdapter(pool_connections=pool_size,
+                          pool_maxsize=pool_size)
+    session = requests.Session()
+    session.mount('https://', adapter)
+    session.mount('http://', adapter)
+    return session
+
+session = make_session()
+
+limiter = RateLimiter()
+
+breaker = CircuitBreaker()
+
+game_cache = TTLCache(ttl=GAME_CACHE_TTL,
+                      stale_ttl=GAME_CACHE_STALE,
+                      max_entries=GAME_CACHE_ENTRIES,
+                      max_bytes=GAME_CACHE_BYTES,
+                      sizeof=sizeof)
+
+search_cache = TTLCache(ttl=SEARCH_CACHE_TTL,
+                        max_entries=SEARCH_CACHE_ENTRIES)
+
+# Concurrent misses for the same resource share one upstream call
+flights = SingleFlight()
+
+# Runs independent RAWG calls side by side for fetch_all
+executor = ThreadPoolExecutor(max_workers=POOL_SIZE, thread_name_prefix='rawg')
+
+def remaining(deadline):
+    """Seconds left before deadline (a time.monotonic() value), or None"""
+
+    if deadline is None:
+        return None
+    left = deadline - time.monotonic()
+    if left <= 0:
+        raise RawgUnavailable('request time budget exhausted')
+    return left
+
+def retry_after(resp):
+    """Seconds the response's Retry-After header asks us to wait, or None"""
+
+    value = resp.headers.get('Retry-After', '').strip()
+    if value.isdigit():
+        return int(value)
+    try:
+        when = parsedate_to_datetime(value)
+        return max(0, (when - datetime.now(timezone.utc)).total_seconds())
+    except (TypeError, ValueError):
+        return None
+
+def get(path='', deadline=None, **params):
+    """GET a RAWG resource below BASE_URL and return the parsed JSON
+
+    Each attempt waits briefly for a rate limiter token and fails fast
+    with RawgRateLimited if none comes.  A 429 raises RawgRateLimited too,
+    and no further calls are made for as long as its Retry-After asks.  A
+    404 raises RawgNotFound.  Connection errors and 5xx responses are
+    retried with exponential backoff, then raise RawgUnavailable.  No
+    attempt is started after `deadline`, and every attempt's timeouts are
+    cut to fit inside it.
+    """
+
+    params['key'] = API_KEY
+    for attempt in range(RETRIES + 1):
+        left = remaining(deadline)
+        # Checked first so an outage neither waits for nor spends quota
+        if breaker.is_open():
+            raise RawgUnavailable('RAWG circuit breaker is open')
+        if not limiter.acquire(QUEUE_WAIT if left is None else min(QUEUE_WAIT, left)):
+            raise RawgRateLimited('RAWG request quota exhausted')
+        if not breaker.allow():
+            limiter.release()
+            raise RawgUnavailable('RAWG circuit breaker is open')
+        timeout = (CONNECT_TIMEOUT, READ_TIMEOUT)
+        if left is not None:
+            timeout = (min(CONNECT_TIMEOUT, left), min(READ_TIMEOUT, left))
+        try:
+            resp = session.get(f'{BASE_URL}{path}', params=params, timeout=timeout)
+        except requests.RequestException as e:
+            breaker.record(False)
+            error = RawgUnavailable(str(e))
+        else:
+            breaker.record(resp.status_code < 500)
+            if resp.ok:
+                return loads(resp.content)
+            message = f'RAWG returned {resp.status_code} for {path or "search"}'
+            if resp.status_code == 429:
+                wait_for = retry_after(resp)
+                if wait_for:
+                    limiter.pause(wait_for)
+                raise RawgRateLimited(message)
+            if resp.status_code == 404:
+                raise RawgNotFound(message)
+            if resp.status_code < 500:
+                raise RawgError(message)
+            error = RawgUnavailable(message)
+        if attempt < RETRIES:
+            pause = BACKOFF * 2 ** attempt
+            left = remaining(deadline)
+            if left is not None and left <= pause:
+                break
+            time.sleep(pause)
+    raise error
+
+def shared(key, fn, deadline=None):
+    """Run fn through the single-flight group, waiting no later than deadline"""
+
+    try:
+        return flights.do(key, fn, timeout=remaining(deadline))
+    except TimeoutError as e:
+        raise RawgUnavailable(str(e)) from e
+
+def get_game(game_id, deadline=None):
+    """GameDetail for a single game, served from game_cache when possible"""
+
+    game_id = str(game_id)
+
+    def load(deadline=None):
+        return shared(('game', game_id),
+                      lambda: GameDetail.from_api(get(f'/{game_id}', deadline=deadline)),
+                      deadline)
+
+    return game_cache.fetch(game_id, lambda: load(deadline), refresh=load,
+                            fallback=RawgUnavailable)
+
+def get_screenshots(game_id, deadline=None):
+    """List of screenshots for a single game"""
+
+    game_id = str(game_id)
+    return shared(('screenshots', game_id),
+                  lambda: get(f'/{game_id}/screenshots', deadline=deadline)['results'],
+                  deadline)
+
+def fetch_all(calls, deadline=None):
+    """Run independent RAWG calls concurrently under one shared deadline
+
+    `calls` maps a name to a function taking the deadline.  Returns a dict
+    of the same names mapped to each result, or to the RawgError it
+    raised.  Calls still running at the deadline map to RawgUnavailable.
+    """
+
+    futures = {name: executor.submit(call, deadline) for name, call in calls.items()}
+    try:
+        timeout = remaining(deadline)
+    except RawgUnavailable:
+        timeout = 0
+    wait(futures.values(), timeout=timeout)
+
+    results = {}
+    for name, future in futures.items():
+        if not future.done():
+            results[name] = RawgUnavailable(f'{name} did not finish in time')
+        elif isinstance(future.exception(), RawgError):
+            results[name] = future.exception()
+        else:
+            results[name] = future.result()
+    return results
+
+def normalize_query(query):
+    """Lowercase search terms and collapse punctuation and whitespace"""
+
+    return ' '.join(re.sub(r'[^\w\s]', ' ', query.lower()).split())
+
+def search_games(query, deadline=None):
+    """SearchResults matching search terms, cached by normalized query"""
+
+    query = normalize_query(query)
+    if not query:
+        return []
+
+    def load(deadline=None):
+        return shared(('search', query),
+                      lambda: [SearchResult.from_api(game)
+                               for game in get(search=query, deadline=deadline)['results']],
+                      deadline)
+
+    return search_cache.fetch(query, lambda: load(deadline), refresh=load,
+                              fallback=RawgUnavailable)
+
+def stats():
+    """Usage counters for the RAWG quota, breaker and caches"""
+
+    return {'quota': limiter.usage(),
+            'breaker': breaker.state,
+            'games': game_cache.stats(),
+            'search': search_cache.stats()}
@@ -364,4 +364,50 @@ async function deleteReview(review_id){
     })
     const game_id = resp.data.game_id
     window.open(`/games/${game_id}/reviews`, '_self')
-}
\ No newline at end of file
+}
+
+/// Suggest known games while typing in the search bar
+const suggestionCache = new Map()
+
+function debounce(func, wait){
+    let timeout
+    return function(...args){
+        clearTimeout(timeout)
+        timeout = setTimeout(() => func(...args), wait)
+    }
+}
+
+async function getSuggestions(text){
+    const q = text.trim().toLowerCase()
+    if (suggestionCache.has(q)){
+        return suggestionCache.get(q)
+    }
+    const resp = await axios({
+        method: "GET",
+        url: '/games/typeahead',
+        params: {q}
+    })
+    suggestionCache.set(q, resp.data.games)
+    return resp.data.games
+}
+
+function showSuggestions(games){
+    const list = document.querySelector('#gamelist')
+    list.innerHTML = ''
+    for (const game of games){
+        const option = document.createElement('option')
+        option.value = game.name
+        list.append(option)
+    }
+}
+
+const searchBar = document.querySelector('#game')
+if (searchBar){
+    searchBar.addEventListener('input', debounce(async function(e){
+        const text = e.target.value
+        if (text.trim().length < 2){
+            return
+        }
+        showSuggestions(await getSuggestions(text))
+    }, 200))
+}
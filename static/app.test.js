@@ -55,4 +55,23 @@ it('should display and remove answer edit box', function(){
     ans.remove()
     p.remove()
     text.remove()
+})
+
+it('should list game suggestions', function(){
+    const list = document.createElement('datalist')
+    list.id = 'gamelist'
+    document.body.append(list)
+    showSuggestions([{id: 1, name: 'testgame'}, {id: 2, name: 'testgame2'}])
+    expect(list.children.length).toEqual(2)
+    expect(list.children[0].value).toEqual('testgame')
+    showSuggestions([])
+    expect(list.children.length).toEqual(0)
+    list.remove()
+})
+
+it('should answer repeat suggestions from the cache', async function(){
+    suggestionCache.set('testgame', [{id: 1, name: 'testgame'}])
+    const games = await getSuggestions(' TestGame ')
+    expect(games).toEqual([{id: 1, name: 'testgame'}])
+    suggestionCache.clear()
 })
\ No newline at end of file
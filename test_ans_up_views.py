@@ -3,11 +3,11 @@ from unittest import TestCase
 from flask_bcrypt import Bcrypt
 bcrypt = Bcrypt()
 
-from models import db, User, Game, Review, Question, Answer, Upvote
+from models import db, reconcile_counts, User, Game, Review, Question, Answer, Upvote
 
 os.environ['DATABASE_URL'] = "postgresql:///gamey_test"
 
-from app import app
+from app import app, page_cache
 
 db.create_all()
 
@@ -31,6 +31,7 @@ class AnsUpViewsTestCase(TestCase):
         Upvote.query.delete()
 
         self.client = app.test_client()
+        page_cache.clear()
 
         hashed_pwd = bcrypt.generate_password_hash("HASHED_PASSWORD").decode('UTF-8')
 
@@ -140,6 +141,9 @@ class AnsUpViewsTestCase(TestCase):
         db.session.commit()
         self.a_upvote_id = aupv.id
 
+        reconcile_counts()
+        db.session.commit()
+
     def tearDown(self):
         db.session.rollback()
 
@@ -211,6 +215,7 @@ class AnsUpViewsTestCase(TestCase):
             self.assertEqual(data, {'text': "testanswer2", 
                                     'username': self.username})
             self.assertEqual(Answer.query.count(), 3)
+            self.assertEqual(Question.query.get(self.question_id).answer_count, 3)
 
 
     def test_edit_answer(self):
@@ -257,6 +262,7 @@ class AnsUpViewsTestCase(TestCase):
             self.assertEqual(data, {'review': self.review_id2, 
                                     'username': self.username2})
             self.assertEqual(Upvote.query.count(), 3)
+            self.assertEqual(Review.query.get(self.review_id2).upvote_count, 1)
 
     def test_unlike_review(self):
         """Can you remove a like on a review from database"""
@@ -272,6 +278,41 @@ class AnsUpViewsTestCase(TestCase):
             data = resp.json
             self.assertEqual(data, {'review': self.review_id})
             self.assertEqual(Upvote.query.count(), 1)
+            self.assertEqual(Review.query.get(self.review_id).upvote_count, 0)
+
+    def test_like_review_twice(self):
+        """Does liking a review again leave one upvote"""
+
+        with self.client as c:
+            with c.session_transaction() as sess:
+                sess['username'] = self.username2
+
+            url = f"/reviews/{self.review_id}/upvote"
+            resp = c.post(url)
+
+            self.assertEqual(resp.status_code, 200)
+            self.assertEqual(Upvote.query.count(), 2)
+            self.assertEqual(Review.query.get(self.review_id).upvote_count, 1)
+
+    def test_toggle_review_upvote(self):
+        """Does toggling flip the upvote and return the new count"""
+
+        with self.client as c:
+            with c.session_transaction() as sess:
+                sess['username'] = self.username2
+
+            url = f"/reviews/{self.review_id}/toggle_upvote"
+            resp = c.post(url)
+
+            self.assertEqual(resp.status_code, 200)
+            self.assertEqual(resp.json, {'review': self.review_id, 'upvoted': False, 'upvotes': 0})
+
+            resp = c.post(url)
+            self.assertEqual(resp.json, {'review': self.review_id, 'upvoted': True, 'upvotes': 1})
+            self.assertEqual(Upvote.query.count(), 2)
+
+            resp = c.post("/reviews/999999/toggle_upvote")
+            self.assertEqual(resp.status_code, 404)
 
     def test_like_answer(self):
         """Can you add a like on an answer to database"""
@@ -302,4 +343,20 @@ class AnsUpViewsTestCase(TestCase):
             self.assertEqual(resp.status_code, 200)
             data = resp.json
             self.assertEqual(data, {'answer': self.answer_id})
-            self.assertEqual(Upvote.query.count(), 1)
\ No newline at end of file
+            self.assertEqual(Upvote.query.count(), 1)
+
+    def test_reconcile_counts(self):
+        """Are counters recomputed from the underlying rows"""
+
+        review = Review.query.get(self.review_id)
+        review.upvote_count = 10
+        question = Question.query.get(self.question_id)
+        question.answer_count = 0
+        db.session.commit()
+
+        reconcile_counts()
+        db.session.commit()
+
+        self.assertEqual(Review.query.get(self.review_id).upvote_count, 1)
+        self.assertEqual(Answer.query.get(self.answer_id).upvote_count, 1)
+        self.assertEqual(Question.query.get(self.question_id).answer_count, 2)
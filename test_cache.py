@@ -0,0 +1,170 @@
+import time
+import threading
+from unittest import TestCase
+
+from cache import TTLCache, SingleFlight
+
+
+class TTLCacheTestCase(TestCase):
+    """Test in-process TTL/LRU cache"""
+
+    def test_get_set(self):
+        """Does a stored value come back?"""
+
+        cache = TTLCache(ttl=60)
+        cache.set('a', 1)
+
+        self.assertEqual(cache.get('a'), 1)
+        self.assertIsNone(cache.get('b'))
+        self.assertEqual(cache.stats()['hits'], 1)
+        self.assertEqual(cache.stats()['misses'], 1)
+
+    def test_expiry(self):
+        """Do entries expire after ttl?"""
+
+        cache = TTLCache(ttl=0.01)
+        cache.set('a', 1)
+        time.sleep(0.02)
+
+        self.assertIsNone(cache.get('a'))
+
+    def test_entry_ttl(self):
+        """Does a ttl given to set override the cache's?"""
+
+        cache = TTLCache(ttl=60)
+        cache.set('a', 1, ttl=0.01)
+        cache.set('b', 2)
+        time.sleep(0.02)
+
+        self.assertIsNone(cache.get('a'))
+        self.assertEqual(cache.get('b'), 2)
+
+    def test_delete_where(self):
+        """Are only matching keys dropped?"""
+
+        cache = TTLCache(ttl=60, sizeof=len)
+        cache.set('/games/1', 'xx')
+        cache.set('/games/1/reviews?', 'yy')
+        cache.set('/games/10', 'zz')
+        cache.delete_where(lambda key: key.startswith('/games/1/') or key == '/games/1')
+
+        self.assertEqual(len(cache), 1)
+        self.assertEqual(cache.get('/games/10'), 'zz')
+        self.assertEqual(cache.nbytes, 2)
+
+    def test_lru_eviction(self):
+        """Is the least recently used entry evicted first?"""
+
+        cache = TTLCache(ttl=60, max_entries=2)
+        cache.set('a', 1)
+        cache.set('b', 2)
+        cache.get('a')
+        cache.set('c', 3)
+
+        self.assertEqual(cache.get('a'), 1)
+        self.assertIsNone(cache.get('b'))
+        self.assertEqual(len(cache), 2)
+
+    def test_byte_budget(self):
+        """Are entries evicted to stay under max_bytes?"""
+
+        cache = TTLCache(ttl=60, max_bytes=10, sizeof=len)
+        cache.set('a', 'x' * 6)
+        cache.set('b', 'y' * 6)
+
+        self.assertIsNone(cache.get('a'))
+        self.assertEqual(cache.get('b'), 'y' * 6)
+        self.assertEqual(cache.nbytes, 6)
+
+    def test_fetch_miss(self):
+        """Does fetch call the loader once and then serve from cache?"""
+
+        cache = TTLCache(ttl=60)
+        calls = []
+        loader = lambda: calls.append(1) or 'value'
+
+        self.assertEqual(cache.fetch('a', loader), 'value')
+        self.assertEqual(cache.fetch('a', loader), 'value')
+        self.assertEqual(len(calls), 1)
+
+    def test_stale_while_revalidate(self):
+        """Is a stale entry served while one background refresh runs?"""
+
+        cache = TTLCache(ttl=0.01, stale_ttl=60)
+        cache.set('a', 'old')
+        time.sleep(0.02)
+        refreshed = threading.Event()
+
+        def loader():
+            refreshed.set()
+            return 'new'
+
+        self.assertEqual(cache.fetch('a', loader), 'old')
+        self.assertTrue(refreshed.wait(1))
+        for i in range(100):
+            if cache.get('a', allow_stale=True) == 'new':
+                break
+            time.sleep(0.01)
+        self.assertEqual(cache.get('a', allow_stale=True), 'new')
+
+    def test_fetch_fallback(self):
+        """Is an expired value served when the loader fails?"""
+
+        cache = TTLCache(ttl=0.01)
+        cache.set('a', 'old')
+        time.sleep(0.02)
+
+        def fail():
+            raise ValueError('upstream down')
+
+        self.assertEqual(cache.fetch('a', fail, fallback=ValueError), 'old')
+        with self.assertRaises(ValueError):
+            cache.fetch('b', fail, fallback=ValueError)
+        with self.assertRaises(ValueError):
+            cache.fetch('a', fail)
+
+
+class SingleFlightTestCase(TestCase):
+    """Test request coalescing"""
+
+    def test_concurrent_calls_share_result(self):
+        """Do concurrent callers for one key share a single call?"""
+
+        flights = SingleFlight()
+        started = threading.Event()
+        release = threading.Event()
+        calls = []
+        results = []
+
+        def slow():
+            calls.append(1)
+            started.set()
+            release.wait(1)
+            return 'value'
+
+        leader = threading.Thread(target=lambda: results.append(flights.do('a', slow)))
+        leader.start()
+        started.wait(1)
+        followers = [threading.Thread(target=lambda: results.append(flights.do('a', slow)))
+                     for i in range(5)]
+        for t in followers:
+            t.start()
+        time.sleep(0.05)
+        release.set()
+        for t in [leader] + followers:
+            t.join(1)
+
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(results, ['value'] * 6)
+
+    def test_error_is_shared(self):
+        """Is the leader's exception raised and the key released?"""
+
+        flights = SingleFlight()
+
+        def fail():
+            raise ValueError('upstream down')
+
+        with self.assertRaises(ValueError):
+            flights.do('a', fail)
+        self.assertEqual(flights.do('a', lambda: 'value'), 'value')
@@ -0,0 +1,110 @@
+import os
+import time
+import tempfile
+from io import BytesIO
+from unittest import TestCase, skipIf
+from unittest.mock import patch
+import requests
+
+import images
+
+
+def response(body, headers=None):
+    """A canned streamed image response"""
+
+    resp = requests.Response()
+    resp.status_code = 200
+    resp.headers.update(headers or {})
+    resp.raw = BytesIO(body)
+    return resp
+
+
+class ImageProxyTestCase(TestCase):
+    """Test image proxy helpers"""
+
+    def test_proxied_url(self):
+        """Are only RAWG media URLs pointed at the proxy?"""
+
+        url = 'https://media.rawg.io/media/games/456/test.jpg'
+
+        self.assertEqual(images.proxied_url(url, 'card'),
+                         '/images/card?src=https%3A%2F%2Fmedia.rawg.io%2Fmedia%2Fgames%2F456%2Ftest.jpg')
+        self.assertEqual(images.proxied_url('/static/images/default_image.png'),
+                         '/static/images/default_image.png')
+        self.assertEqual(images.proxied_url('https://example.com/test.jpg'),
+                         'https://example.com/test.jpg')
+        self.assertIsNone(images.proxied_url(None))
+
+    def test_get_image_rejects_other_hosts(self):
+        """Does the proxy refuse URLs outside RAWG media?"""
+
+        with self.assertRaises(images.ImageError):
+            images.get_image('http://localhost/secret', 'thumb')
+        with self.assertRaises(images.ImageError):
+            images.get_image('https://media.rawg.io/media/test.jpg', 'huge')
+
+
+    def test_download_size_cap(self):
+        """Are images over MAX_IMAGE_BYTES refused, with or without Content-Length?"""
+
+        url = 'https://media.rawg.io/media/games/456/test.jpg'
+        with patch.object(images, 'MAX_IMAGE_BYTES', 10):
+            with patch.object(images.rawg.session, 'get', return_value=response(b'x' * 10)):
+                self.assertEqual(images.download(url), b'x' * 10)
+            with patch.object(images.rawg.session, 'get', return_value=response(b'x' * 11)):
+                with self.assertRaises(images.ImageError):
+                    images.download(url)
+            with patch.object(images.rawg.session, 'get',
+                              return_value=response(b'', {'Content-Length': '11'})):
+                with self.assertRaises(images.ImageError):
+                    images.download(url)
+
+    @skipIf(images.Image is None, 'Pillow is not installed')
+    def test_resize_bad_images(self):
+        """Do corrupt images and decompression bombs fail as ImageError?"""
+
+        out = BytesIO()
+        images.Image.new('RGB', (100, 100)).save(out, 'PNG')
+
+        with self.assertRaises(images.ImageError):
+            images.resize(b'not an image', (32, 32))
+        with patch.object(images.Image, 'MAX_IMAGE_PIXELS', 100):
+            with self.assertRaises(images.ImageError):
+                images.resize(out.getvalue(), (32, 32))
+        self.assertTrue(images.resize(out.getvalue(), (32, 32)))
+
+
+class DiskCacheTestCase(TestCase):
+    """Test bounded on-disk image cache"""
+
+    def setUp(self):
+        self.dir = tempfile.TemporaryDirectory()
+        self.cache = images.DiskCache(directory=self.dir.name, max_bytes=25)
+
+    def tearDown(self):
+        self.dir.cleanup()
+
+    def test_put_get(self):
+        """Does a stored file come back?"""
+
+        path = self.cache.put('aa11', b'data')
+
+        self.assertEqual(self.cache.get('aa11'), path)
+        with open(path, 'rb') as f:
+            self.assertEqual(f.read(), b'data')
+        self.assertIsNone(self.cache.get('bb22'))
+
+    def test_lru_eviction(self):
+        """Are least recently used files removed once over budget?"""
+
+        self.cache.put('aa11', b'x' * 10)
+        self.cache.put('bb22', b'x' * 10)
+        old = time.time() - 100
+        os.utime(self.cache.path('aa11'), (old, old))
+        os.utime(self.cache.path('bb22'), (old + 1, old + 1))
+        self.cache.get('aa11')
+        self.cache.put('cc33', b'x' * 10)
+
+        self.assertIsNotNone(self.cache.get('aa11'))
+        self.assertIsNone(self.cache.get('bb22'))
+        self.assertIsNotNone(self.cache.get('cc33'))
@@ -1,10 +1,13 @@
 import os
+import threading
+from datetime import datetime
 from unittest import TestCase
 from flask_bcrypt import Bcrypt
 from sqlalchemy import exc
 bcrypt = Bcrypt()
 
-from models import db, User, Game, Review, Question, Answer, Upvote
+import models
+from models import db, readable_time, unindexed_foreign_keys, needs_rehash, check_pwd, HashBusy, BCRYPT_LOG_ROUNDS, User, Game, Review, Question, Answer, Upvote
 
 os.environ['DATABASE_URL'] = "postgresql:///gamey_test"
 
@@ -113,6 +116,38 @@ class UserModelTestCase(TestCase):
 
         self.assertEqual(resp, user)
 
+    def test_authenticate_rehash(self):
+        """Does authenticate upgrade a hash made at another cost?"""
+
+        old_rounds = 5 if BCRYPT_LOG_ROUNDS == 4 else 4
+        user = User.query.get(self.username)
+        user.password = bcrypt.generate_password_hash("HASHED_PASSWORD", old_rounds).decode('UTF-8')
+        db.session.commit()
+
+        self.assertTrue(needs_rehash(user.password))
+        resp = User.authenticate(self.username, "HASHED_PASSWORD")
+        db.session.commit()
+
+        self.assertEqual(resp, user)
+        self.assertFalse(needs_rehash(User.query.get(self.username).password))
+        self.assertTrue(User.authenticate(self.username, "HASHED_PASSWORD"))
+
+    def test_hash_busy(self):
+        """Is a hash stuck behind a full pool cancelled instead of waited on?"""
+
+        release = threading.Event()
+        blockers = [models.hash_pool.submit(release.wait) for i in range(models.BCRYPT_WORKERS)]
+        timeout = models.BCRYPT_TIMEOUT
+        models.BCRYPT_TIMEOUT = 0.05
+        try:
+            with self.assertRaises(HashBusy):
+                check_pwd(User.query.get(self.username).password, "HASHED_PASSWORD")
+        finally:
+            models.BCRYPT_TIMEOUT = timeout
+            release.set()
+        for blocker in blockers:
+            blocker.result()
+
     def test_authenticate_bad_name(self):
         """Does authenticate return false when bad username?"""
 
@@ -131,3 +166,34 @@ class UserModelTestCase(TestCase):
 
         self.assertEqual(resp, False)
 
+    def test_game_search(self):
+        """Does local game search match names and words?"""
+
+        db.session.add(Game(id=5, name='The Legend of Zelda'))
+        db.session.add(Game(id=6, name='Super Mario Bros.'))
+        db.session.commit()
+
+        self.assertEqual([g.id for g in Game.search('zelda')], [5])
+        self.assertEqual([g.id for g in Game.search('Legend')], [5])
+        self.assertEqual([g.id for g in Game.search('mario b')], [6])
+        self.assertEqual(Game.search('100%'), [])
+        self.assertEqual(Game.search(''), [])
+        self.assertEqual(Game.search('   '), [])
+
+    def test_readable_time(self):
+        """Does formatting a timestamp leave the model untouched?"""
+
+        db.session.add(Game(id=5, name='The Legend of Zelda'))
+        db.session.add(Question(id=1, title='Q', text='text', game_id=5,
+                                username=self.username, timestamp=datetime(2021, 2, 3, 16, 5)))
+        db.session.commit()
+
+        question = Question.query.get(1)
+        self.assertEqual(readable_time(question.timestamp), '02/03/21  04:05 PM')
+        self.assertIsInstance(question.timestamp, datetime)
+        self.assertNotIn(question, db.session.dirty)
+
+    def test_foreign_keys_indexed(self):
+        """Does every foreign key have an index to serve joins and cascades?"""
+
+        self.assertEqual(unindexed_foreign_keys(), [])
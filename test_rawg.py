@@ -0,0 +1,275 @@
+import time
+from unittest import TestCase
+from unittest.mock import patch
+import requests
+
+import rawg
+
+
+def response(status_code, headers=None):
+    """A canned RAWG response"""
+
+    resp = requests.Response()
+    resp.status_code = status_code
+    resp.headers.update(headers or {})
+    resp._content = b'{}'
+    return resp
+
+
+class RawgSearchTestCase(TestCase):
+    """Test RAWG search helpers"""
+
+    def test_normalize_query(self):
+        """Do equivalent searches share one key?"""
+
+        self.assertEqual(rawg.normalize_query('Zelda'), 'zelda')
+        self.assertEqual(rawg.normalize_query(' zelda  '), 'zelda')
+        self.assertEqual(rawg.normalize_query('ZELDA'), 'zelda')
+        self.assertEqual(rawg.normalize_query("Zelda: Breath of the  Wild!"),
+                         'zelda breath of the wild')
+        self.assertEqual(rawg.normalize_query('?!'), '')
+
+    def test_project_search_result(self):
+        """Are unused fields dropped from search results?"""
+
+        game = {'id': 1,
+                'name': 'testgame',
+                'background_image': 'test_background_image',
+                'platforms': [{'platform': {'id': 4, 'name': 'PC', 'slug': 'pc'}}],
+                'ratings': [{'id': 5, 'count': 100}],
+                'tags': [{'id': 31, 'name': 'Singleplayer'}]}
+        result = rawg.SearchResult.from_api(game)
+
+        self.assertEqual(result.id, 1)
+        self.assertEqual(result.name, 'testgame')
+        self.assertEqual(result.background_image, 'test_background_image')
+        self.assertEqual(result.platforms, ('PC',))
+        self.assertFalse(hasattr(result, '__dict__'))
+
+    def test_project_game(self):
+        """Is a game payload projected to the fields we display?"""
+
+        game = rawg.GameDetail.from_api({'id': 1,
+                                         'name': 'testgame',
+                                         'esrb_rating': {'id': 3, 'name': 'Teen'},
+                                         'platforms': [{'platform': {'name': 'PC'}}],
+                                         'stores': [{'id': 1}]})
+
+        self.assertEqual(game.esrb_rating, 'Teen')
+        self.assertEqual(game.platforms, ('PC',))
+        self.assertIsNone(game.released)
+        self.assertGreater(rawg.sizeof(game), 0)
+
+    def test_search_cache(self):
+        """Are repeat searches served from the cache?"""
+
+        rawg.search_cache.clear()
+        results = [rawg.SearchResult(id=1, name='testgame')]
+        rawg.search_cache.set('zelda', results)
+
+        self.assertEqual(rawg.search_games('ZELDA '), results)
+        self.assertEqual(rawg.search_games('?!'), [])
+        rawg.search_cache.clear()
+
+
+class CircuitBreakerTestCase(TestCase):
+    """Test RAWG circuit breaker"""
+
+    def test_opens_on_failure_rate(self):
+        """Does the breaker open once enough calls fail?"""
+
+        breaker = rawg.CircuitBreaker(window=4, min_calls=4, failure_rate=0.5, reset_timeout=60)
+        for success in (True, False, True):
+            breaker.record(success)
+
+        self.assertTrue(breaker.allow())
+        breaker.record(False)
+        self.assertEqual(breaker.state, breaker.OPEN)
+        self.assertFalse(breaker.allow())
+
+    def test_half_open_trial(self):
+        """Is a single trial call let through after the reset timeout?"""
+
+        breaker = rawg.CircuitBreaker(window=2, min_calls=1, failure_rate=0.5, reset_timeout=0)
+        breaker.record(False)
+
+        self.assertTrue(breaker.allow())
+        self.assertEqual(breaker.state, breaker.HALF_OPEN)
+        self.assertFalse(breaker.allow())
+        breaker.record(True)
+        self.assertEqual(breaker.state, breaker.CLOSED)
+
+    def test_half_open_failure_reopens(self):
+        """Does a failed trial call re-open the breaker?"""
+
+        breaker = rawg.CircuitBreaker(window=2, min_calls=1, failure_rate=0.5, reset_timeout=0)
+        breaker.record(False)
+        breaker.allow()
+        breaker.record(False)
+
+        self.assertEqual(breaker.state, breaker.OPEN)
+
+    def test_open_breaker_fails_fast(self):
+        """Are calls rejected without touching the network while open?"""
+
+        breaker = rawg.breaker
+        breaker.state = breaker.OPEN
+        breaker.opened_at = time.monotonic()
+        try:
+            with self.assertRaises(rawg.RawgUnavailable):
+                rawg.get('/1')
+        finally:
+            breaker.state = breaker.CLOSED
+
+    def test_open_breaker_spends_no_quota(self):
+        """Does a call rejected by an open breaker leave the rate limiter alone?"""
+
+        breaker = rawg.breaker
+        breaker.state = breaker.OPEN
+        breaker.opened_at = time.monotonic()
+        before = rawg.limiter.usage()
+        try:
+            for i in range(5):
+                with self.assertRaises(rawg.RawgUnavailable):
+                    rawg.get('/1')
+        finally:
+            breaker.state = breaker.CLOSED
+
+        after = rawg.limiter.usage()
+        self.assertEqual(after['used_today'], before['used_today'])
+        self.assertEqual(after['rejected_today'], before['rejected_today'])
+        self.assertGreaterEqual(after['tokens'], before['tokens'])
+
+    def test_deadline(self):
+        """Are calls rejected once the request budget is spent?"""
+
+        with self.assertRaises(rawg.RawgUnavailable):
+            rawg.get('/1', deadline=time.monotonic() - 1)
+
+
+class GetTestCase(TestCase):
+    """Test how RAWG responses map to errors"""
+
+    def setUp(self):
+        self.patches = [patch.object(rawg, 'limiter', rawg.RateLimiter(rate=100, burst=100, daily_quota=100)),
+                        patch.object(rawg, 'breaker', rawg.CircuitBreaker()),
+                        patch.object(rawg, 'BACKOFF', 0)]
+        for p in self.patches:
+            p.start()
+
+    def tearDown(self):
+        for p in self.patches:
+            p.stop()
+
+    def test_not_found(self):
+        """Is an unknown game a RawgNotFound rather than an outage?"""
+
+        with patch.object(rawg.session, 'get', return_value=response(404)) as get:
+            with self.assertRaises(rawg.RawgNotFound):
+                rawg.get('/1')
+
+        self.assertEqual(get.call_count, 1)
+
+    def test_server_errors_unavailable(self):
+        """Do retried 5xx responses end in RawgUnavailable?"""
+
+        with patch.object(rawg.session, 'get', return_value=response(502)) as get:
+            with self.assertRaises(rawg.RawgUnavailable):
+                rawg.get('/1')
+
+        self.assertEqual(get.call_count, rawg.RETRIES + 1)
+
+    def test_connection_errors_unavailable(self):
+        """Do retried connection errors end in RawgUnavailable?"""
+
+        with patch.object(rawg.session, 'get', side_effect=requests.ConnectionError('refused')):
+            with self.assertRaises(rawg.RawgUnavailable):
+                rawg.get('/1')
+
+
+    def test_rate_limited_by_rawg(self):
+        """Does a 429 hold off further calls for its Retry-After?"""
+
+        with patch.object(rawg.session, 'get', return_value=response(429, {'Retry-After': '30'})) as get:
+            with self.assertRaises(rawg.RawgRateLimited):
+                rawg.get('/1')
+            with self.assertRaises(rawg.RawgRateLimited):
+                rawg.get('/1')
+
+        self.assertEqual(get.call_count, 1)
+        self.assertGreater(rawg.limiter.usage()['paused_for'], 29)
+
+    def test_rate_limited_serves_stale(self):
+        """Is an expired search result served when RAWG answers 429?"""
+
+        results = [rawg.SearchResult(id=1, name='testgame')]
+        with patch.object(rawg, 'search_cache', rawg.TTLCache(ttl=-1)):
+            rawg.search_cache.set('zelda', results)
+            with patch.object(rawg.session, 'get', return_value=response(429)):
+                self.assertEqual(rawg.search_games('zelda'), results)
+
+    def test_retry_after(self):
+        """Are both forms of Retry-After understood?"""
+
+        self.assertEqual(rawg.retry_after(response(429, {'Retry-After': '120'})), 120)
+        self.assertGreater(rawg.retry_after(response(429, {'Retry-After': 'Fri, 01 Jan 2100 00:00:00 GMT'})), 0)
+        self.assertIsNone(rawg.retry_after(response(429)))
+        self.assertIsNone(rawg.retry_after(response(429, {'Retry-After': 'soon'})))
+
+
+class FetchAllTestCase(TestCase):
+    """Test concurrent fan-out of RAWG calls"""
+
+    def test_calls_run_concurrently(self):
+        """Do independent calls overlap instead of running back to back?"""
+
+        def slow(deadline):
+            time.sleep(0.2)
+            return 'done'
+
+        start = time.monotonic()
+        results = rawg.fetch_all({'a': slow, 'b': slow})
+
+        self.assertEqual(results, {'a': 'done', 'b': 'done'})
+        self.assertLess(time.monotonic() - start, 0.35)
+
+    def test_errors_and_deadline(self):
+        """Are failures and late calls reported per call?"""
+
+        def fail(deadline):
+            raise rawg.RawgError('upstream down')
+
+        def late(deadline):
+            time.sleep(0.3)
+            return 'done'
+
+        results = rawg.fetch_all({'fail': fail, 'late': late},
+                                 deadline=time.monotonic() + 0.1)
+
+        self.assertIsInstance(results['fail'], rawg.RawgError)
+        self.assertIsInstance(results['late'], rawg.RawgUnavailable)
+
+
+class RateLimiterTestCase(TestCase):
+    """Test client-side RAWG quota accounting"""
+
+    def test_burst_then_refill(self):
+        """Are calls limited to the burst size and then the refill rate?"""
+
+        limiter = rawg.RateLimiter(rate=20, burst=2, daily_quota=100)
+
+        self.assertTrue(limiter.acquire())
+        self.assertTrue(limiter.acquire())
+        self.assertFalse(limiter.acquire())
+        self.assertTrue(limiter.acquire(timeout=0.2))
+        self.assertEqual(limiter.usage()['used_today'], 3)
+        self.assertEqual(limiter.usage()['rejected_today'], 1)
+
+    def test_daily_quota(self):
+        """Are calls refused once the daily quota is used up?"""
+
+        limiter = rawg.RateLimiter(rate=100, burst=100, daily_quota=2)
+
+        self.assertTrue(limiter.acquire())
+        self.assertTrue(limiter.acquire())
+        self.assertFalse(limiter.acquire(timeout=0.1))
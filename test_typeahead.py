@@ -0,0 +1,50 @@
+from unittest import TestCase
+
+from typeahead import PrefixIndex
+
+
+class PrefixIndexTestCase(TestCase):
+    """Test typeahead prefix index"""
+
+    def setUp(self):
+        self.index = PrefixIndex()
+        self.index.load([(1, 'The Legend of Zelda'),
+                         (2, 'Super Mario Bros.'),
+                         (3, 'Super Metroid')])
+
+    def test_name_prefix(self):
+        """Does the start of a name match?"""
+
+        self.assertEqual(self.index.search('the leg'), [(1, 'The Legend of Zelda')])
+        self.assertEqual(self.index.search('SUPER M'),
+                         [(2, 'Super Mario Bros.'), (3, 'Super Metroid')])
+
+    def test_word_prefix(self):
+        """Does the start of any later word match?"""
+
+        self.assertEqual(self.index.search('zel'), [(1, 'The Legend of Zelda')])
+        self.assertEqual(self.index.search('metr'), [(3, 'Super Metroid')])
+
+    def test_limit_and_empty(self):
+        """Are results limited and blank searches ignored?"""
+
+        self.assertEqual(len(self.index.search('super', limit=1)), 1)
+        self.assertEqual(self.index.search('  '), [])
+        self.assertEqual(self.index.search('xyz'), [])
+
+    def test_add(self):
+        """Are new games found without reloading?"""
+
+        self.index.add(4, 'Zelda II')
+
+        self.assertEqual(self.index.search('zelda'),
+                         [(1, 'The Legend of Zelda'), (4, 'Zelda II')])
+
+    def test_rename(self):
+        """Is a renamed game found only by its new name?"""
+
+        self.index.add(3, 'Super Metroid Deluxe')
+
+        self.assertEqual(self.index.search('deluxe'), [(3, 'Super Metroid Deluxe')])
+        self.assertEqual(self.index.search('super metroid'), [(3, 'Super Metroid Deluxe')])
+        self.assertEqual(len(self.index), 10)
@@ -1,13 +1,21 @@
 import os
+import time
+import tempfile
 from unittest import TestCase
+from unittest.mock import patch
 from flask_bcrypt import Bcrypt
+from sqlalchemy import event
 bcrypt = Bcrypt()
 
-from models import db, User, Game, Review, Question, Answer, Upvote
+from models import db, reconcile_counts, User, Game, Review, Question, Answer, Upvote
 
 os.environ['DATABASE_URL'] = "postgresql:///gamey_test"
 
-from app import app
+from app import app, feed_cache, page_cache
+import rawg
+import images
+import requests
+from typeahead import game_index
 
 db.create_all()
 
@@ -31,6 +39,8 @@ class ViewsTestCase(TestCase):
         Upvote.query.delete()
 
         self.client = app.test_client()
+        page_cache.clear()
+        game_index.loaded = False
 
         hashed_pwd = bcrypt.generate_password_hash("HASHED_PASSWORD").decode('UTF-8')
 
@@ -112,10 +122,68 @@ class ViewsTestCase(TestCase):
         db.session.commit()
         self.question_id2 = q2.id
 
+        reconcile_counts()
+        db.session.commit()
+
     def tearDown(self):
         db.session.rollback()
 
 
+    def test_homepage_feed_invalidation(self):
+        """Does the cached homepage feed pick up new reviews"""
+
+        feed_cache.clear()
+
+        with self.client as c:
+            with c.session_transaction() as sess:
+                sess['username'] = self.username
+
+            resp = c.get('/')
+            html = resp.get_data(as_text=True)
+
+            self.assertEqual(resp.status_code, 200)
+            self.assertIn('testreview2', html)
+            self.assertNotIn('testreview3', html)
+
+            c.post('/games/1/review',
+                    data={'title': 'testreview3',
+                            'rating': 1.4,
+                            'text': 'testreviewtext3'})
+            resp = c.get('/')
+            html = resp.get_data(as_text=True)
+
+            self.assertIn('testreview3', html)
+
+    def test_anonymous_page_cache(self):
+        """Are anonymous pages cached until a write route changes them"""
+
+        with self.client as c:
+            resp = c.get('/games/1/reviews')
+            self.assertNotIn('testreview3', resp.get_data(as_text=True))
+
+            db.session.add(Review(title='testreview3', text='text', rating=5,
+                                  game_id=1, username=self.username))
+            db.session.commit()
+            resp = c.get('/games/1/reviews')
+            self.assertNotIn('testreview3', resp.get_data(as_text=True))
+
+            with c.session_transaction() as sess:
+                sess['username'] = self.username
+            resp = c.get('/games/1/reviews')
+            self.assertIn('testreview3', resp.get_data(as_text=True))
+
+            c.post('/games/1/review',
+                    data={'title': 'testreview4',
+                            'rating': 1.4,
+                            'text': 'testreviewtext4'})
+            with c.session_transaction() as sess:
+                del sess['username']
+                sess.pop('_flashes', None)
+            resp = c.get('/games/1/reviews')
+            html = resp.get_data(as_text=True)
+            self.assertIn('testreview3', html)
+            self.assertIn('testreview4', html)
+
     def test_show_profile_logged_out(self):
         """User profile page when not logged in"""
 
@@ -127,6 +195,48 @@ class ViewsTestCase(TestCase):
             self.assertIn('testuser', html)
             self.assertNotIn('Edit Profile', html)
 
+    def test_profile_query_count(self):
+        """Does the profile page run the same number of queries for more content"""
+
+        def count_queries():
+            statements = []
+            record = lambda *args: statements.append(args[2])
+            page_cache.clear()
+            event.listen(db.engine, 'before_cursor_execute', record)
+            try:
+                self.client.get(f'/users/{self.username}')
+            finally:
+                event.remove(db.engine, 'before_cursor_execute', record)
+            return len(statements)
+
+        before = count_queries()
+        for i in range(5):
+            db.session.add(Game(id=100 + i, name=f'game{i}'))
+            db.session.add(Review(title=f'review{i}', text='text', rating=5,
+                                  game_id=100 + i, username=self.username))
+        db.session.commit()
+
+        self.assertEqual(count_queries(), before)
+
+    def test_current_user_loaded_once(self):
+        """Is the logged-in user read from the database once per request"""
+
+        statements = []
+        record = lambda *args: statements.append(args[2])
+        with self.client as c:
+            with c.session_transaction() as sess:
+                sess['username'] = self.username
+
+            db.session.expunge_all()
+            event.listen(db.engine, 'before_cursor_execute', record)
+            try:
+                resp = c.get(f'/users/{self.username}')
+            finally:
+                event.remove(db.engine, 'before_cursor_execute', record)
+
+        self.assertEqual(resp.status_code, 200)
+        self.assertEqual(len([s for s in statements if 'FROM users' in s]), 1)
+
     def test_show_profile_logged_in(self):
         """User profile page when logged in"""
 
@@ -200,6 +310,164 @@ class ViewsTestCase(TestCase):
             self.assertIn('Game Over', html)
             self.assertEqual(len(users), 1)
 
+    def test_show_game_info_from_snapshot(self):
+        """Is game info rendered from the stored snapshot"""
+
+        game = Game.query.get(1)
+        game.update_snapshot(rawg.GameDetail.from_api({
+                              'id': 1,
+                              'name': 'testgame',
+                              'background_image': 'test_background_image',
+                              'released': '2020-01-01',
+                              'website': 'http://testgame.com',
+                              'esrb_rating': {'name': 'Teen'},
+                              'platforms': [{'platform': {'name': 'PC'}}],
+                              'description': '<p>testdescription</p>'}))
+        db.session.commit()
+
+        with self.client as c:
+
+            resp = c.get('/games/1')
+            html = resp.get_data(as_text=True)
+
+            self.assertEqual(resp.status_code, 200)
+            self.assertIn('Released 2020-01-01', html)
+            self.assertIn('ESRB Rating: Teen', html)
+            self.assertIn('PC', html)
+            self.assertIn('testdescription', html)
+
+    def test_show_game_info_degraded(self):
+        """Does game info render from the local row when RAWG is unavailable"""
+
+        rawg.breaker.state = rawg.breaker.OPEN
+        rawg.breaker.opened_at = time.monotonic()
+        rawg.game_cache.clear()
+
+        try:
+            with self.client as c:
+
+                resp = c.get('/games/1')
+                html = resp.get_data(as_text=True)
+
+                self.assertEqual(resp.status_code, 200)
+                self.assertIn('testgame', html)
+                self.assertIn('temporarily unavailable', html)
+        finally:
+            rawg.breaker.state = rawg.breaker.CLOSED
+
+    def test_show_unknown_game(self):
+        """Is a game RAWG doesn't know a 404 rather than an outage"""
+
+        with patch.object(rawg, 'get_game', side_effect=rawg.RawgNotFound('RAWG returned 404 for /99')):
+            with self.client as c:
+
+                for path in ('/games/99', '/games/99/reviews', '/games/99/questions'):
+                    resp = c.get(path)
+                    self.assertEqual(resp.status_code, 404)
+
+    def test_image_proxy(self):
+        """Are cached images served without fetching, and failed fetches sent to the original"""
+
+        src = 'https://media.rawg.io/media/games/456/test.jpg'
+        with tempfile.TemporaryDirectory() as directory, \
+             patch.object(images, 'disk_cache', images.DiskCache(directory=directory)), \
+             patch.object(rawg.session, 'get', side_effect=requests.ConnectionError('refused')) as get:
+            with self.client as c:
+
+                images.disk_cache.put(images.cache_key(src, 'full'), b'imagedata')
+                resp = c.get('/images/full', query_string={'src': src})
+                self.assertEqual(resp.status_code, 200)
+                self.assertEqual(resp.data, b'imagedata')
+                self.assertEqual(resp.headers['ETag'], f'"{images.cache_key(src, "full")}"')
+                get.assert_not_called()
+
+                other = 'https://media.rawg.io/media/games/789/other.jpg'
+                resp = c.get('/images/thumb', query_string={'src': other})
+                self.assertEqual(resp.status_code, 302)
+                self.assertEqual(resp.location, other)
+                get.assert_called_once()
+
+    def test_image_proxy_rejects(self):
+        """Are other hosts and unknown sizes refused by the image proxy"""
+
+        with self.client as c:
+
+            resp = c.get('/images/thumb', query_string={'src': 'http://localhost/secret.jpg'})
+            self.assertEqual(resp.status_code, 404)
+            resp = c.get('/images/huge', query_string={'src': 'https://media.rawg.io/media/test.jpg'})
+            self.assertEqual(resp.status_code, 404)
+
+    def test_typeahead(self):
+        """Does typeahead return matching games as JSON, at most ten"""
+
+        for id in range(2, 14):
+            db.session.add(Game(id=id, name=f'typeahead game {id}'))
+        db.session.commit()
+
+        with self.client as c:
+
+            resp = c.get('/games/typeahead?q=TESTG')
+            self.assertEqual(resp.status_code, 200)
+            self.assertEqual(resp.get_json(), {'games': [{'id': 1, 'name': 'testgame'}]})
+
+            games = c.get('/games/typeahead?q=typeahead').get_json()['games']
+            self.assertEqual(len(games), 10)
+            self.assertTrue(all(set(game) == {'id', 'name'} for game in games))
+
+            self.assertEqual(c.get('/games/typeahead?q=').get_json(), {'games': []})
+            self.assertEqual(c.get('/games/typeahead').get_json(), {'games': []})
+
+    def test_typeahead_index_follows_commits(self):
+        """Are games indexed on commit, dropped on rollback and re-indexed when renamed"""
+
+        game_index.load([])
+
+        db.session.add(Game(id=2, name='phantomgame'))
+        db.session.flush()
+        db.session.rollback()
+        self.assertEqual(game_index.search('phantom'), [])
+
+        db.session.add(Game(id=3, name='newgame'))
+        db.session.commit()
+        self.assertEqual(game_index.search('newg'), [(3, 'newgame')])
+
+        Game.query.get(3).update_snapshot(rawg.GameDetail(id=3, name='renamedgame'))
+        db.session.commit()
+        self.assertEqual(game_index.search('newg'), [])
+        self.assertEqual(game_index.search('renamed'), [(3, 'renamedgame')])
+
+    def test_search_local_catalog(self):
+        """Are searches answered from known games when there are enough"""
+
+        game = Game.query.get(1)
+        game.update_snapshot(rawg.GameDetail(id=1, name='testgame', platforms=('PC',)))
+        db.session.commit()
+        app.config['LOCAL_SEARCH_MIN_RESULTS'] = 1
+
+        try:
+            with self.client as c:
+
+                resp = c.get('/games/search?game=TESTGAME')
+                html = resp.get_data(as_text=True)
+
+                self.assertEqual(resp.status_code, 200)
+                self.assertIn("<a href='/games/1'>testgame</a>", html)
+                self.assertIn('Search all games', html)
+        finally:
+            app.config['LOCAL_SEARCH_MIN_RESULTS'] = 5
+
+    def test_search_blank(self):
+        """Does a blank search show no results instead of every game"""
+
+        with self.client as c:
+
+            resp = c.get('/games/search?game=')
+            html = resp.get_data(as_text=True)
+
+            self.assertEqual(resp.status_code, 200)
+            self.assertIn('No results found', html)
+            self.assertNotIn("<a href='/games/1'>", html)
+
     def test_show_game_reviews(self):
         """Are reviews listed on reviews page"""
 
@@ -214,6 +482,29 @@ class ViewsTestCase(TestCase):
             self.assertIn('Average User Rating: 8.5', html)
             self.assertNotIn('Add A Review', html)
 
+    def test_game_reviews_pagination(self):
+        """Are reviews paged newest first with a link to older ones"""
+
+        app.config['PAGE_SIZE'] = 1
+
+        try:
+            with self.client as c:
+
+                resp = c.get('/games/1/reviews')
+                html = resp.get_data(as_text=True)
+
+                self.assertIn(f"/reviews/{self.review_id2}'", html)
+                self.assertNotIn(f"/reviews/{self.review_id}'", html)
+                self.assertIn(f'/games/1/reviews?before={self.review_id2}', html)
+
+                resp = c.get(f'/games/1/reviews?before={self.review_id2}')
+                html = resp.get_data(as_text=True)
+
+                self.assertIn(f"/reviews/{self.review_id}'", html)
+                self.assertNotIn('Older Reviews', html)
+        finally:
+            app.config['PAGE_SIZE'] = 20
+
     def test_add_review_logged_out(self):
         """Can you add a review when logged out"""
 
@@ -264,6 +555,34 @@ class ViewsTestCase(TestCase):
             self.assertIn('testtext', html)
             self.assertNotIn('Edit Review', html)
 
+    def test_review_not_modified(self):
+        """Is a repeat request for an unchanged review answered with 304"""
+
+        with self.client as c:
+            resp = c.get(f'/reviews/{self.review_id}')
+            etag = resp.headers['ETag']
+            self.assertNotIn('Last-Modified', resp.headers)
+
+            resp = c.get(f'/reviews/{self.review_id}',
+                         headers={'If-Modified-Since': 'Fri, 01 Jan 2100 00:00:00 GMT'})
+            self.assertEqual(resp.status_code, 200)
+
+            resp = c.get(f'/reviews/{self.review_id}', headers={'If-None-Match': etag})
+            self.assertEqual(resp.status_code, 304)
+            self.assertEqual(resp.get_data(), b'')
+
+            with c.session_transaction() as sess:
+                sess['username'] = 'testuser2'
+            resp = c.get(f'/reviews/{self.review_id}', headers={'If-None-Match': etag})
+            self.assertEqual(resp.status_code, 200)
+
+            c.post(f'/reviews/{self.review_id}/upvote')
+            with c.session_transaction() as sess:
+                del sess['username']
+            resp = c.get(f'/reviews/{self.review_id}', headers={'If-None-Match': etag})
+            self.assertEqual(resp.status_code, 200)
+            self.assertNotEqual(resp.headers['ETag'], etag)
+
     def test_edit_review_logged_out(self):
         """Can logged out user edit review"""
 
@@ -296,6 +615,7 @@ class ViewsTestCase(TestCase):
             self.assertEqual(resp.status_code, 200)
             self.assertIn('testreviewtext3', html)
             self.assertIn('testreview3 - 1.4', html)
+            self.assertEqual(Game.query.get(1).average_rating, 4.7)
 
     def test_edit_wrong_review(self):
         """Can you edit a review written by someone else"""
@@ -327,6 +647,7 @@ class ViewsTestCase(TestCase):
             self.assertEqual(resp.status_code, 200)
             data = resp.json
             self.assertEqual(data, {"game_id": 1})
+            self.assertEqual(Game.query.get(1).average_rating, 8)
 
     def test_show_game_questions(self):
         """Are questions listed on questions page"""
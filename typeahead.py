@@ -0,0 +1,87 @@
+import threading
+from bisect import bisect_left, insort
+from rawg import normalize_query
+
+
+class PrefixIndex:
+    """In-memory sorted index of game names for prefix lookups
+
+    Every word boundary of a name is indexed, so 'zel' and 'legend of'
+    both find 'The Legend of Zelda'.  Lookups are a binary search plus a
+    short scan and never touch the database.
+    """
+
+    def __init__(self):
+        self.loaded = False
+        self._keys = []
+        self._names = {}
+        self._lock = threading.Lock()
+        self._load_lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._keys)
+
+    def load(self, games):
+        """Replace the index with (id, name) pairs"""
+
+        keys = []
+        names = {}
+        for id, name in games:
+            keys.extend(self._entries(id, name))
+            names[id] = name
+        keys.sort()
+        with self._lock:
+            self._keys = keys
+            self._names = names
+            self.loaded = True
+
+    def ensure_loaded(self, fetch_games):
+        """Load from fetch_games() the first time the index is used"""
+
+        if self.loaded:
+            return
+        with self._load_lock:
+            if not self.loaded:
+                self.load(fetch_games())
+
+    def add(self, id, name):
+        """Index a single game, replacing its old name if it had one"""
+
+        with self._lock:
+            if id in self._names:
+                for entry in self._entries(id, self._names[id]):
+                    i = bisect_left(self._keys, entry)
+                    if i < len(self._keys) and self._keys[i] == entry:
+                        del self._keys[i]
+            self._names[id] = name
+            for entry in self._entries(id, name):
+                insort(self._keys, entry)
+
+    def search(self, prefix, limit=10):
+        """List of (id, name) for games with a word starting with prefix"""
+
+        prefix = normalize_query(prefix)
+        if not prefix:
+            return []
+
+        results = []
+        seen = set()
+        with self._lock:
+            i = bisect_left(self._keys, (prefix,))
+            while i < len(self._keys) and len(results) < limit:
+                key, id, name = self._keys[i]
+                if not key.startswith(prefix):
+                    break
+                if id not in seen:
+                    seen.add(id)
+                    results.append((id, name))
+                i += 1
+        return results
+
+    @staticmethod
+    def _entries(id, name):
+        words = normalize_query(name).split()
+        return [(' '.join(words[i:]), id, name) for i in range(len(words))]
+
+
+game_index = PrefixIndex()